@@ -1,14 +1,30 @@
+import json
+import os
+import threading
+
+import metrics
+import node_geometry
 import numpy as np
 import torch
 import torch.nn as nn
 import torchvision.transforms as transforms
+import torchvision.transforms.functional as F
+from text_embedding_cache import TextEmbeddingCache
+from torch.nn.utils.rnn import pad_sequence
 from torchvision import models
-from transformers import BertModel, BertTokenizer
+from transformers import BertModel, BertTokenizer, BertTokenizerFast
 
 
 class Config:
     def __init__(self):
-        self.device = torch.device("cuda:0")
+        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        # 以下仅在 CPU 上生效
+        # 对 BERT 和各 MLP 的 Linear 层做动态 int8 量化
+        self.cpu_quantize = False
+        # ResNet18 使用 channels_last 内存布局
+        self.cpu_channels_last = True
+        # 算子内线程数，None 时使用 torch 默认值
+        self.cpu_num_threads = None
         self.image_dim = 1000
         self.text_dim = 768 * 4
 
@@ -32,11 +48,40 @@ class Config:
         self.checkpoint_file = (
             "../../../model_checkpoint/vision_class_model/mlp_a11y_v1_part_label.pt"
         )
+        # eager: 从 checkpoint 构建模型；torchscript: 加载 export_engine.py 导出的 engine_dir
+        self.backend = "eager"
+        self.engine_dir = (
+            "../../../model_checkpoint/vision_class_model/mlp_a11y_v1_engine"
+        )
+
+        # cascade: 先用只看属性向量的小模型给所有节点打分，正例概率落在
+        # cascade_band 之内的节点再交给完整模型，小模型由 train_attribute_model.py 训练
+        self.cascade = False
+        self.cascade_band = (0.05, 0.95)
+        self.cascade_hidden_dims = [64]
+        self.cascade_checkpoint_file = (
+            "../../../model_checkpoint/vision_class_model/mlp_a11y_v1_attribute.pt"
+        )
+
+        self.text_pretrained_name = "bert-base-uncased"
+        self.text_fast_tokenizer = True
+        # longest: 按长度分桶后补齐到桶内最长；max_length: 全部补齐到 text_max_length
+        self.text_padding = "longest"
+        self.text_max_length = 512
+        self.text_encode_batch_size = 256
+        # 文本 embedding 缓存，cache_file 为 None 时只在内存中缓存
+        self.text_embedding_cache_size = 100000
+        self.text_embedding_cache_file = "./text_embedding_cache.db"
 
 
 config = Config()
 
 
+def checkpoint_identity(checkpoint_file):
+    stat = os.stat(checkpoint_file)
+    return f"{os.path.abspath(checkpoint_file)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
 class MLP(nn.Module):
     def __init__(
         self,
@@ -48,8 +93,8 @@ class MLP(nn.Module):
         super().__init__()
 
         self.layers = nn.Sequential()
-        if not hidden_dims:
-            hidden_dims = []
+        # 复制一份，多次构建模型时不修改 config 里的列表
+        hidden_dims = list(hidden_dims) if hidden_dims else []
 
         hidden_dims.insert(0, input_dim)
         hidden_dims.append(output_dim)
@@ -85,8 +130,14 @@ class MLPModel(nn.Module):
         self, image_dim, text_dim, mlp_model, text_mlp_model, attribute_mlp_model
     ):
         super().__init__()
-        self.tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
-        self.text_pretrained_model = BertModel.from_pretrained("bert-base-uncased")
+        tokenizer_class = (
+            BertTokenizerFast if config.text_fast_tokenizer else BertTokenizer
+        )
+        self.tokenizer = tokenizer_class.from_pretrained(config.text_pretrained_name)
+        self.text_pretrained_model = BertModel.from_pretrained(
+            config.text_pretrained_name
+        )
+        self.text_embedding_cache = None
         self.vision_pretrained_model = models.resnet18(pretrained=True)
         self.vision_pretrained_model.conv1 = nn.Conv2d(
             4, 64, kernel_size=7, stride=2, padding=3, bias=False
@@ -103,31 +154,25 @@ class MLPModel(nn.Module):
             batch["attribute"],
         )  # texts: [3, N]
 
-        text_embeddings = []
-        for text in texts:
-            encoded_inputs = self.tokenizer(
-                text,
-                add_special_tokens=True,
-                padding="max_length",
-                max_length=512,
-                return_tensors="pt",
-                truncation=True,
-            ).to(config.device)
-
-            with torch.no_grad():
-                # [N, H]
-                text_embeddings.append(
-                    self.text_pretrained_model(**encoded_inputs).last_hidden_state[
-                        :, 0, :
-                    ]
-                )
+        # [X, N, H]
+        with metrics.timer("v2_text"):
+            text_embeddings = [self.encode_text(text) for text in texts]
 
-        with torch.no_grad():
+        if config.device.type == "cpu" and config.cpu_channels_last:
+            image = image.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), metrics.timer("v2_resnet"):
             image_embeddings = self.vision_pretrained_model(image)
 
         # text_embeddings: [X, N, H] --> [N, X, H] --> [N, X * H]
         text_embeddings = torch.stack(text_embeddings, dim=0).permute(1, 0, 2)
         text_embeddings = text_embeddings.reshape(text_embeddings.shape[0], -1)
+        with metrics.timer("v2_mlp"):
+            return self.classify(text_embeddings, image_embeddings, attribute)
+
+    def classify(self, text_embeddings, image_embeddings, attribute):
+        """
+        text_embeddings: [N, X * H]，image_embeddings: [N, image_dim]
+        """
         text_embeddings = self.text_mlp_model(text_embeddings)
 
         attribute_embeddings = self.attribute_mlp_model(attribute)
@@ -137,33 +182,301 @@ class MLPModel(nn.Module):
         )
         return torch.softmax(self.mlp_model(total_embeddings), dim=1)
 
+    def text_cls(self, input_ids, attention_mask):
+        """
+        返回 BERT 最后一层的 [CLS] embedding [N, H]
+        """
+        return self.text_pretrained_model(
+            input_ids=input_ids, attention_mask=attention_mask, return_dict=False
+        )[0][:, 0, :]
+
+    def encode_text(self, text):
+        """
+        text: N 个字符串，返回 [N, H] 的 [CLS] embedding，相同字符串只过一次 BERT
+        """
+        embeddings = {}
+        if self.text_embedding_cache is not None:
+            embeddings = self.text_embedding_cache.get_many(text)
+
+        missing = [t for t in dict.fromkeys(text) if t not in embeddings]
+        if missing:
+            # 与缓存命中的结果一样放在 CPU 上，拼接后再整体移到 config.device
+            missing_embeddings = self.embed_text(missing).to("cpu", torch.float32)
+            if self.text_embedding_cache is not None:
+                self.text_embedding_cache.put_many(missing, missing_embeddings)
+            embeddings.update(zip(missing, missing_embeddings))
+
+        return torch.stack([embeddings[t] for t in text], dim=0).to(config.device)
+
+    def embed_text(self, text, padding=None, tokenizer=None, max_length=None):
+        """
+        不经过缓存直接计算 [CLS] embedding，返回 [N, H]，顺序与 text 一致
+        """
+        padding = padding or config.text_padding
+        tokenizer = tokenizer or self.tokenizer
+        max_length = max_length or config.text_max_length
+        batch_size = config.text_encode_batch_size
+
+        if padding == "max_length":
+            embeddings = []
+            for i in range(0, len(text), batch_size):
+                with metrics.timer("v2_tokenize"):
+                    encoded_inputs = tokenizer(
+                        text[i : i + batch_size],
+                        add_special_tokens=True,
+                        padding="max_length",
+                        max_length=max_length,
+                        return_tensors="pt",
+                        truncation=True,
+                    ).to(config.device)
+
+                with torch.no_grad(), metrics.timer("v2_bert"):
+                    embeddings.append(
+                        self.text_cls(
+                            encoded_inputs["input_ids"],
+                            encoded_inputs["attention_mask"],
+                        )
+                    )
+            return torch.cat(embeddings, dim=0)
+
+        with metrics.timer("v2_tokenize"):
+            input_ids = tokenizer(
+                text,
+                add_special_tokens=True,
+                max_length=max_length,
+                truncation=True,
+            )["input_ids"]
+        # 按 token 数排序分桶，桶内只补齐到最长的那条
+        order = sorted(range(len(text)), key=lambda i: len(input_ids[i]))
+        embeddings = None
+        for i in range(0, len(order), batch_size):
+            bucket = order[i : i + batch_size]
+            bucket_ids = pad_sequence(
+                [torch.tensor(input_ids[j]) for j in bucket],
+                batch_first=True,
+                padding_value=tokenizer.pad_token_id,
+            )
+            lengths = torch.tensor([len(input_ids[j]) for j in bucket])
+            attention_mask = (
+                torch.arange(bucket_ids.shape[1])[None, :] < lengths[:, None]
+            ).long()
+
+            with torch.no_grad(), metrics.timer("v2_bert"):
+                bucket_embeddings = self.text_cls(
+                    bucket_ids.to(config.device), attention_mask.to(config.device)
+                )
+
+            if embeddings is None:
+                embeddings = bucket_embeddings.new_empty(
+                    (len(text), bucket_embeddings.shape[1])
+                )
+            embeddings[bucket] = bucket_embeddings
+        return embeddings
+
+
+class ScriptedMLPModel(MLPModel):
+    """
+    加载 export_engine.py 导出的 TorchScript 模型，接口与 MLPModel 相同
+    不需要构建 BERT、ResNet18 再加载 checkpoint
+    """
+
+    def __init__(self, engine_dir):
+        nn.Module.__init__(self)
+        tokenizer_class = (
+            BertTokenizerFast if config.text_fast_tokenizer else BertTokenizer
+        )
+        self.tokenizer = tokenizer_class.from_pretrained(engine_dir)
+        self.text_embedding_cache = None
+        self.text_encoder = torch.jit.load(
+            os.path.join(engine_dir, "text_encoder.pt"), map_location=config.device
+        )
+        self.vision_pretrained_model = torch.jit.load(
+            os.path.join(engine_dir, "vision_encoder.pt"), map_location=config.device
+        )
+        self.classifier = torch.jit.load(
+            os.path.join(engine_dir, "classifier.pt"), map_location=config.device
+        )
+
+    def classify(self, text_embeddings, image_embeddings, attribute):
+        return self.classifier(text_embeddings, image_embeddings, attribute)
+
+    def text_cls(self, input_ids, attention_mask):
+        return self.text_encoder(input_ids, attention_mask)
+
+
+model = None
+model_lock = threading.Lock()
+
+
+def engine_info():
+    """
+    导出时写入的 engine.json
+    """
+    with open(
+        os.path.join(config.engine_dir, "engine.json"), "r", encoding="utf-8"
+    ) as f:
+        return json.load(f)
+
 
-text_mlp_model = MLP(
-    config.text_mlp_input_dim,
-    config.text_mlp_hidden_dims,
-    config.text_mlp_output_dim,
-    config.text_mlp_dropout,
-).to(config.device)
-attribute_mlp_model = MLP(
-    config.attribute_mlp_input_dim,
-    config.attribute_mlp_hidden_dims,
-    config.attribute_mlp_output_dim,
-    config.attribute_mlp_dropout,
-).to(config.device)
-mlp_model = MLP(
-    config.mlp_input_dim,
-    config.mlp_hidden_dims,
-    config.mlp_output_dim,
-    config.mlp_dropout,
-).to(config.device)
-model = MLPModel(
-    config.image_dim,
-    config.text_dim,
-    mlp_model,
-    text_mlp_model,
-    attribute_mlp_model,
-).to(config.device)
-model.load_state_dict(torch.load(config.checkpoint_file, map_location=config.device))
+def model_version():
+    """
+    checkpoint 与影响输出的文本编码配置的标识
+    """
+    if config.backend == "torchscript":
+        return f"torchscript:{engine_info()['model_version']}{cascade_version()}"
+    return (
+        f"{checkpoint_identity(config.checkpoint_file)}:"
+        f"{config.text_pretrained_name}:{config.text_max_length}:"
+        f"{'int8' if quantized() else 'fp32'}{cascade_version()}"
+    )
+
+
+def cascade_version():
+    if not config.cascade:
+        return ""
+    low, high = config.cascade_band
+    return (
+        f":cascade:{checkpoint_identity(config.cascade_checkpoint_file)}:{low}:{high}"
+    )
+
+
+def quantized():
+    return config.device.type == "cpu" and config.cpu_quantize
+
+
+def optimize_for_cpu(model):
+    """
+    CPU 推理优化：channels_last 布局和动态 int8 量化
+    """
+    if config.cpu_channels_last:
+        model.vision_pretrained_model.to(memory_format=torch.channels_last)
+    if config.cpu_quantize:
+        # 只量化 Linear 层，卷积层保持 fp32
+        model.text_pretrained_model = torch.quantization.quantize_dynamic(
+            model.text_pretrained_model, {nn.Linear}, dtype=torch.qint8
+        )
+        for name in ["text_mlp_model", "attribute_mlp_model", "mlp_model"]:
+            setattr(
+                model,
+                name,
+                torch.quantization.quantize_dynamic(
+                    getattr(model, name), {nn.Linear}, dtype=torch.qint8
+                ),
+            )
+    return model
+
+
+def build_model():
+    """
+    从 checkpoint 构建 eager 模型，不带文本 embedding 缓存
+    """
+    text_mlp_model = MLP(
+        config.text_mlp_input_dim,
+        config.text_mlp_hidden_dims,
+        config.text_mlp_output_dim,
+        config.text_mlp_dropout,
+    ).to(config.device)
+    attribute_mlp_model = MLP(
+        config.attribute_mlp_input_dim,
+        config.attribute_mlp_hidden_dims,
+        config.attribute_mlp_output_dim,
+        config.attribute_mlp_dropout,
+    ).to(config.device)
+    mlp_model = MLP(
+        config.mlp_input_dim,
+        config.mlp_hidden_dims,
+        config.mlp_output_dim,
+        config.mlp_dropout,
+    ).to(config.device)
+    model = MLPModel(
+        config.image_dim,
+        config.text_dim,
+        mlp_model,
+        text_mlp_model,
+        attribute_mlp_model,
+    ).to(config.device)
+    model.load_state_dict(
+        torch.load(config.checkpoint_file, map_location=config.device)
+    )
+    # 推理时关闭 dropout，BN 使用训练得到的统计量，
+    # 否则每个节点的结果会受同一批其他节点影响
+    model.eval()
+    if config.device.type == "cpu":
+        model = optimize_for_cpu(model)
+    return model
+
+
+def load_model():
+    if config.device.type == "cpu" and config.cpu_num_threads:
+        torch.set_num_threads(config.cpu_num_threads)
+
+    tokenizer = "fast" if config.text_fast_tokenizer else "slow"
+    if config.backend == "torchscript":
+        model = ScriptedMLPModel(config.engine_dir)
+        cache_version = f"{config.text_max_length}:{tokenizer}:{model_version()}"
+    else:
+        model = build_model()
+        cache_version = (
+            f"{config.text_pretrained_name}:{config.text_max_length}:{tokenizer}:"
+            f"{'int8' if quantized() else 'fp32'}:"
+            f"{checkpoint_identity(config.checkpoint_file)}"
+        )
+    # 所有推理路径（包括 parity_check 直接调用的 embed_text）都关闭 dropout，
+    # 否则文本 embedding 每次不同，也不能缓存
+    model.eval()
+    model.text_embedding_cache = TextEmbeddingCache(
+        cache_version,
+        max_size=config.text_embedding_cache_size,
+        cache_file=config.text_embedding_cache_file,
+    )
+    if config.cascade:
+        # 和完整模型一起预热，多进程服务时在 fork 前加载
+        get_attribute_model()
+    return model
+
+
+def get_model():
+    """
+    第一次调用时加载模型，之后直接返回
+    """
+    global model
+    if model is None:
+        with model_lock:
+            if model is None:
+                model = load_model()
+    return model
+
+
+attribute_model = None
+attribute_model_lock = threading.Lock()
+
+
+def build_attribute_model():
+    """
+    cascade 的小模型，输入与 MLPModel 的属性向量相同
+    """
+    return MLP(
+        config.attribute_mlp_input_dim,
+        config.cascade_hidden_dims,
+        config.mlp_output_dim,
+        0,
+    ).to(config.device)
+
+
+def get_attribute_model():
+    global attribute_model
+    if attribute_model is None:
+        with attribute_model_lock:
+            if attribute_model is None:
+                model = build_attribute_model()
+                model.load_state_dict(
+                    torch.load(
+                        config.cascade_checkpoint_file, map_location=config.device
+                    )
+                )
+                model.eval()
+                attribute_model = model
+    return attribute_model
 
 
 class ScreenshotMaskTransform:
@@ -194,70 +507,247 @@ class RGBNormalizeTransform:
         return tensor
 
 
-def pred_model(image, nodes):
-    images, texts, attributes = [], [[], [], [], []], []
-    for node in nodes:
-        transform = transforms.Compose(
-            [
-                ScreenshotMaskTransform(node["algo_coordinator"]),
-                transforms.ToTensor(),
-                transforms.Resize(256),
-                RGBNormalizeTransform([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-            ]
-        )
-
-        images.append(transform(image))
-        texts[0].append(
-            node["class_name"].split(".")[-1].lower()
-            if node.get("class_name", None)
-            else "none"
-        )
-        texts[1].append(
-            node["view_id_resource_name"].split("/")[-1].lower()
-            if node.get("view_id_resource_name", None)
+image_resize = transforms.Resize(256)
+screenshot_transform = transforms.Compose(
+    [
+        transforms.ToTensor(),
+        image_resize,
+        RGBNormalizeTransform([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ]
+)
+
+
+def resize_1d(tensor, size):
+    """
+    tensor: [N, L]，沿最后一维按 image_resize 的插值方式缩放到 size
+    """
+    resized = F.resize(
+        tensor.unsqueeze(1),
+        [1, size],
+        interpolation=image_resize.interpolation,
+        antialias=image_resize.antialias,
+    )
+    return resized.squeeze(1)
+
+
+def create_masks(image_size, coordinators, size):
+    """
+    直接在缩放后的分辨率上批量生成节点 mask，返回 [N, h, w]
+    与 ScreenshotMaskTransform + ToTensor + Resize 的结果一致：
+    矩形 mask 是行、列指示向量的外积，而缩放在两个方向上可分离
+    image_size: 原图 (w, h)，coordinators: [N, 4] (left, right, top, bottom)
+    size: 缩放后的 (h, w)
+    """
+    w, h = image_size
+    left, right, top, bottom = torch.as_tensor(coordinators).reshape(-1, 4).unbind(1)
+    xs, ys = torch.arange(w), torch.arange(h)
+    # ToTensor 会把 uint8 的 mask 值 1 变成 1 / 255
+    cols = ((xs >= left[:, None]) & (xs < right[:, None])).float() / 255
+    rows = ((ys >= top[:, None]) & (ys < bottom[:, None])).float()
+    cols = resize_1d(cols, size[1])
+    rows = resize_1d(rows, size[0])
+    return rows[:, :, None] * cols[:, None, :]
+
+
+def text_fields(class_name, view_id_resource_name, content_description, text):
+    """
+    模型使用的四个文本字段：class name, resource id, content description, text
+    """
+    return (
+        class_name.split(".")[-1].lower() if class_name else "none",
+        (
+            view_id_resource_name.split("/")[-1].lower()
+            if view_id_resource_name
             else "none"
+        ),
+        content_description if content_description else "none",
+        text if text else "none",
+    )
+
+
+def node_texts(node):
+    return text_fields(
+        node.get("class_name"),
+        node.get("view_id_resource_name"),
+        node.get("content_description"),
+        node.get("text"),
+    )
+
+
+interval = 256
+
+
+def prepare_screenshot(image):
+    """
+    缩放、归一化后的 RGB 截图，同一页的所有节点共用
+    """
+    with metrics.timer("v2_screenshot"):
+        return screenshot_transform(image)
+
+
+def prepare_page(image, page_id, page_nodes, screenshot=None):
+    """
+    一页的模型输入，不依赖模型，可以放在其他进程中执行
+    page_nodes: node_geometry.PageNodes，只包含有效节点
+    screenshot: 已缓存的 prepare_screenshot(image) 结果
+    """
+    if screenshot is None:
+        # RGB 部分每个节点都一样，只处理一次
+        screenshot = prepare_screenshot(image)
+
+    texts = [[], [], [], []]
+    for fields in zip(*(page_nodes.texts[f] for f in node_geometry.text_fields)):
+        for column, text in zip(texts, text_fields(*fields)):
+            column.append(text)
+
+    return {
+        "node_ids": page_nodes.ids.tolist(),
+        "image_size": image.size,
+        "screenshot": screenshot,
+        "coordinators": torch.from_numpy(
+            page_nodes.algo_coordinators(page_id, image.size)
+        ),
+        "texts": texts,
+        "attributes": torch.from_numpy(page_nodes.attributes(page_id)),
+    }
+
+
+def make_batch(segments):
+    """
+    segments: [(page, start, end), ...]，page 为 prepare_page 的结果
+    各页截图缩放后的尺寸需相同
+    """
+    images, texts, attributes = [], [[], [], [], []], []
+    for page, start, end in segments:
+        screenshot = page["screenshot"]
+        masks = create_masks(
+            page["image_size"], page["coordinators"][start:end], screenshot.shape[1:]
         )
-        texts[2].append(
-            node["content_description"]
-            if node.get("content_description", None)
-            else "none"
+        images.append(
+            torch.cat(
+                (screenshot.expand(len(masks), -1, -1, -1), masks.unsqueeze(1)), dim=1
+            )
         )
-        texts[3].append(node["text"] if node.get("text", None) else "none")
-        attribute = [
-            1 if node.get("focusable", None) else 0,
-            1 if node.get("checkable", None) else 0,
-            1 if node.get("checked", None) else 0,
-            1 if node.get("focused", None) else 0,
-            1 if node.get("selected", None) else 0,
-            1 if node.get("clickable", None) else 0,
-            1 if node.get("long_clickable", None) else 0,
-            1 if node.get("context_clickable", None) else 0,
-            1 if node.get("enabled", None) else 0,
-            1 if node.get("text", None) else 0,
-            1 if node.get("content_description", None) else 0,
-        ]
-        attribute += node["normal_algo_cooridnator"]
-        attributes.append(torch.tensor(attribute))
-
+        for field, text in zip(texts, page["texts"]):
+            field.extend(text[start:end])
+        attributes.append(page["attributes"][start:end])
+
+    return {
+        "image": (images[0] if len(images) == 1 else torch.cat(images)).to(
+            config.device
+        ),
+        "text": texts,
+        "attribute": torch.cat(attributes).to(config.device),
+    }
+
+
+def pred_batch(batch):
+    """
+    返回每个节点的 (最大概率, 预测类别)
+    """
+    with torch.no_grad():
+        outputs = get_model()(batch)
+    return torch.max(outputs, 1)
+
+
+def pred_segments(segments):
+    """
+    segments: [(page, start, end), ...]，返回每个节点的 (最大概率, 预测类别) 列表
+    """
+    with metrics.timer("v2_masks"):
+        batch = make_batch(segments)
+    max_p, preds = pred_batch(batch)
+    return list(zip(max_p.tolist(), preds.tolist()))
+
+
+def attribute_probs(attributes):
+    """
+    attributes: [N, 15]，返回小模型给出的正例概率，numpy [N]
+    """
+    with torch.no_grad(), metrics.timer("v2_cascade"):
+        outputs = get_attribute_model()(attributes.to(config.device))
+    return torch.softmax(outputs, dim=1)[:, 1].cpu().numpy()
+
+
+cascade_lock = threading.Lock()
+cascade_nodes = 0
+cascade_escalated = 0
+
+
+def cascade_split(page_nodes, page_id):
+    """
+    返回 (results, escalate)：results 为每个节点的 (最大概率, 预测类别)，
+    需要完整模型的节点为 None；escalate 为这些节点的下标数组
+    不开启 cascade 时全部节点都交给完整模型
+    """
+    if not config.cascade:
+        return [None] * len(page_nodes), np.arange(len(page_nodes))
+
+    probs = attribute_probs(torch.from_numpy(page_nodes.attributes(page_id)))
+    low, high = config.cascade_band
+    uncertain = (probs > low) & (probs < high)
+    results = [
+        None if escalate else (max(p, 1 - p), int(p >= 0.5))
+        for p, escalate in zip(probs.tolist(), uncertain.tolist())
+    ]
+
+    global cascade_nodes, cascade_escalated
+    with cascade_lock:
+        cascade_nodes += len(results)
+        cascade_escalated += int(uncertain.sum())
+    return results, np.flatnonzero(uncertain)
+
+
+def cascade_stats():
+    with cascade_lock:
+        nodes, escalated = cascade_nodes, cascade_escalated
+    return {
+        "nodes": nodes,
+        "escalated": escalated,
+        "escalated_ratio": round(escalated / nodes, 4) if nodes else None,
+    }
+
+
+metrics.register("a11y_v2_cascade", cascade_stats, counters=["nodes", "escalated"])
+
+
+def text_embedding_cache_stats():
+    # 模型加载之前没有缓存
+    if model is None or model.text_embedding_cache is None:
+        return {}
+    return model.text_embedding_cache.stats()
+
+
+metrics.register(
+    "a11y_text_embedding_cache", text_embedding_cache_stats, counters=["hits", "misses"]
+)
+
+
+def page_labels(node_ids, results):
+    """
+    results: 每个节点的 (最大概率, 预测类别)，转成接口返回的 labels 和 probs
+    """
     labels, probs = [], {}
-    if not nodes:
-        return labels, probs
-
-    interval = 256
-    for i in range(0, len(nodes), interval):
-        batch = {
-            "image": torch.stack(images[i : i + interval], dim=0).to(config.device),
-            "text": [text[i : i + interval] for text in texts],
-            "attribute": torch.stack(attributes[i : i + interval], dim=0).to(
-                config.device
-            ),
-        }
-        outputs = model(batch)
-        max_p, preds = torch.max(outputs, 1)
-
-        for j, pred in enumerate(preds):
-            if pred == 1:
-                labels.append(nodes[i + j]["id"])
-            probs[nodes[i + j]["id"]] = round(max_p[j].item(), 2)
-
+    for node_id, (max_p, pred) in zip(node_ids, results):
+        if pred == 1:
+            labels.append(node_id)
+        probs[node_id] = round(max_p, 2)
     return labels, probs
+
+
+def pred_model(image, page_id, nodes):
+    """
+    nodes: 页面 json 中的 nodes，只对坐标有效的节点做预测
+    """
+    page_nodes = node_geometry.valid_page_nodes(page_id, nodes)
+    if not len(page_nodes):
+        return [], {}
+
+    results, escalate = cascade_split(page_nodes, page_id)
+    if len(escalate):
+        page = prepare_page(image, page_id, page_nodes.subset(escalate))
+        for i in range(0, len(escalate), interval):
+            chunk = pred_segments([(page, i, i + interval)])
+            for j, result in zip(escalate[i : i + interval], chunk):
+                results[j] = result
+    return page_labels(page_nodes.ids.tolist(), results)
@@ -1,49 +1,255 @@
 import glob
 import json
 import os
-
-import a11y_mlp_classifier
-import online_focus_classifier
-from flask import Flask, request
+import threading
+import time
+
+import metrics
+import model_loader
+import node_geometry
+import node_sidecar
+import numpy as np
+import prelabel
+import static_delivery
+from flask import Flask, Response, g, request, stream_with_context
 from flask_cors import CORS
-from PIL import Image
-
-app = Flask(__name__)
+from inference_scheduler import InferenceScheduler
+from label_journal import LabelJournal
+from page_index import PageIndex
+from page_registry import PageRegistry
+from prelabel_cache import PrelabelCache
+from sampling_profiler import SamplingProfiler
+from screenshot_cache import ScreenshotCache
+from werkzeug.security import safe_join
+
+# /static 由 get_static 处理
+app = Flask(__name__, static_folder=None)
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 app.config["STATIC_FOLDER"] = static_dir
 CORS(app)
 
-total_page_ids_map = {}
-not_labelled_page_ids_map = {}
-labelled_page_ids_map = {}
+# batch -> PageRegistry
+page_registries = {}
 exclude_dirs = set("bad_data")
+batch_lock = threading.Lock()
+page_indexes = {}
+page_indexes_lock = threading.Lock()
+prelabel_caches = {}
+prelabel_caches_lock = threading.Lock()
+prelabel_stores = {}
+prelabel_stores_lock = threading.Lock()
+label_journals = {}
+label_journals_lock = threading.Lock()
+# 标注日志的 fsync 策略（always / interval / never）和合并到标注文件的间隔秒数
+label_fsync = "interval"
+label_compact_interval = 1.0
+# 每个 batch 预标注结果缓存的大小上限
+prelabel_cache_max_bytes = 64 * 1024 * 1024
+# 各接口共用的截图解码缓存
+screenshot_cache = ScreenshotCache(max_bytes=512 * 1024 * 1024)
+metrics.register(
+    "a11y_screenshot_cache",
+    screenshot_cache.stats,
+    counters=["hits", "misses", "evictions", "prefetches"],
+)
+# 启动后在后台预热的模型
+warm_up_models = ["v1", "v2"]
+# v2 跨请求攒批：凑够 batch_size 个节点或最早的请求等待超过 max_wait 秒就推理一次
+v2_scheduler = InferenceScheduler(
+    lambda segments: model_loader.get("v2").pred_segments(segments),
+    batch_size=256,
+    max_wait=0.02,
+)
+metrics.register(
+    "a11y_v2_scheduler", v2_scheduler.stats, counters=["requests", "batches"]
+)
+# 耗时超过 profile_threshold 秒的请求把采样得到的调用栈写到 profile_dir，None 时关闭
+profile_threshold = None
+profile_interval = 0.005
+profile_dir = "./profiles"
+# 流式预标注先单独算这么多个最可能可交互的节点，尽快返回第一批结果
+stream_first_nodes = 32
+# /get/page 不指定 fields 时返回的节点字段，bounds、valid、index 为计算得到的字段
+page_fields = [
+    "id",
+    "father",
+    "class_name",
+    "text",
+    "content_description",
+    "clickable",
+    "focusable",
+    "long_clickable",
+    "package_name",
+    "focusable_shouldFocusNode",
+    "focusable_isAccessibilityFocusable",
+    "is_web_node",
+    "bounds",
+]
 
 
 def load_all_page():
     for d in os.listdir(static_dir):
         if d in exclude_dirs:
             continue
+        load_batch(d)
 
-        total_page_ids_map[d] = set()
-        not_labelled_page_ids_map[d] = set()
-        labelled_page_ids_map[d] = set()
 
-        dataset_dir = os.path.join(static_dir, d)
-        for json_file in glob.glob(os.path.join(dataset_dir, "*.json")):
-            page_id = int(json_file.split("/")[-1].split(".")[0])
+def load_batch(batch):
+    """
+    第一次访问 batch 时才扫描其页面，返回该 batch 的 PageRegistry
+    """
+    if batch in page_registries:
+        return page_registries[batch]
 
-            total_page_ids_map[d].add(page_id)
-            if os.path.exists(f"{dataset_dir}/labelled/{page_id}.json"):
-                labelled_page_ids_map[d].add(page_id)
-            else:
-                not_labelled_page_ids_map[d].add(page_id)
+    with batch_lock:
+        if batch in page_registries:
+            return page_registries[batch]
+
+        total_page_ids = []
+        labelled_page_ids = []
 
+        dataset_dir = os.path.join(static_dir, batch)
         labelled_dir = os.path.join(dataset_dir, "labelled")
         if not os.path.exists(labelled_dir):
             os.mkdir(labelled_dir)
+        # 先重放上次未合并的标注日志，再按标注文件判断是否已标注
+        get_label_journal(batch)
+
+        for json_file in glob.glob(os.path.join(dataset_dir, "*.json")):
+            page_id = int(json_file.split("/")[-1].split(".")[0])
 
+            total_page_ids.append(page_id)
+            if os.path.exists(f"{dataset_dir}/labelled/{page_id}.json"):
+                labelled_page_ids.append(page_id)
+
+        page_registries[batch] = PageRegistry(total_page_ids, labelled_page_ids)
+        return page_registries[batch]
+
+
+def get_page_index(batch):
+    with page_indexes_lock:
+        if batch not in page_indexes:
+            page_indexes[batch] = PageIndex(
+                os.path.join(static_dir, batch),
+                lambda page_id: handleNodeNum(page_id, batch),
+                lambda page_id: handleLabelledNodeNum(page_id, batch),
+            )
+        return page_indexes[batch]
+
+
+def get_label_journal(batch):
+    with label_journals_lock:
+        if batch not in label_journals:
+            label_journals[batch] = LabelJournal(
+                os.path.join(static_dir, batch, "labelled"),
+                fsync=label_fsync,
+                compact_interval=label_compact_interval,
+            )
+        return label_journals[batch]
+
+
+def label_journal_stats():
+    with label_journals_lock:
+        journals = list(label_journals.values())
+    stats = {}
+    for journal in journals:
+        for field, value in journal.stats().items():
+            stats[field] = stats.get(field, 0) + value
+    return stats
+
+
+metrics.register(
+    "a11y_label_journal",
+    label_journal_stats,
+    counters=["appends", "compactions", "files_written"],
+)
+
+
+def close_label_journals():
+    """
+    退出前把所有标注日志合并到标注文件
+    """
+    with label_journals_lock:
+        journals = list(label_journals.values())
+        label_journals.clear()
+    for journal in journals:
+        journal.close()
+
+
+def get_prelabel_cache(batch):
+    with prelabel_caches_lock:
+        if batch not in prelabel_caches:
+            prelabel_caches[batch] = PrelabelCache(
+                os.path.join(static_dir, batch), max_bytes=prelabel_cache_max_bytes
+            )
+        return prelabel_caches[batch]
+
+
+def get_prelabel_store(batch):
+    """
+    prelabel_batch.py 离线生成的预标注结果，不淘汰
+    """
+    with prelabel_stores_lock:
+        if batch not in prelabel_stores:
+            prelabel_stores[batch] = PrelabelCache(
+                os.path.join(static_dir, batch), max_bytes=None, name="prelabel"
+            )
+        return prelabel_stores[batch]
+
+
+def prelabel_cache_stats(caches, lock):
+    with lock:
+        caches = list(caches.values())
+    stats = {}
+    for cache in caches:
+        for field, value in cache.stats().items():
+            stats[field] = stats.get(field, 0) + value
+    return stats
+
+
+metrics.register(
+    "a11y_prelabel_cache",
+    lambda: prelabel_cache_stats(prelabel_caches, prelabel_caches_lock),
+    counters=["hits", "misses"],
+)
+metrics.register(
+    "a11y_prelabel_store",
+    lambda: prelabel_cache_stats(prelabel_stores, prelabel_stores_lock),
+    counters=["hits", "misses"],
+)
+
+
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    if profile_threshold is not None:
+        g.profiler = SamplingProfiler(threading.get_ident(), profile_interval)
+        g.profiler.start()
+
+
+@app.after_request
+def finish_request(response):
+    seconds = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe(
+        "a11y_request_seconds",
+        seconds,
+        route=route,
+        method=request.method,
+        status=response.status_code,
+    )
 
-load_all_page()
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        if seconds >= profile_threshold:
+            profile_file = profiler.dump(
+                profile_dir, route.strip("/").replace("/", "_") or "root"
+            )
+            app.logger.warning(
+                f"{request.full_path} took {seconds:.3f}s, profile: {profile_file}"
+            )
+    return response
 
 
 @app.route("/")
@@ -51,11 +257,28 @@ def hello_world():
     return "<p>Hello, World!</p>"
 
 
+@app.route("/get/ready", methods=["GET"])
+def get_ready():
+    ready = model_loader.is_ready()
+    return (
+        {
+            "code": 0 if ready else 1,
+            "msg": "success" if ready else "loading",
+            "ready": ready,
+            "models": model_loader.status(),
+            "batches": sorted(page_registries),
+        },
+        200 if ready else 503,
+        {"Content-Type": "application/json"},
+    )
+
+
 @app.route("/post/label", methods=["POST"])
 def save_label():
     body = request.json
     page_id = int(body["page_id"])
-    label = body["label"]
+    # label 为完整的标注；不传 label 时按 add / remove 增删节点
+    label = body.get("label")
     batch = body["batch"]
 
     if not os.path.exists(f"./static/{batch}"):
@@ -65,18 +288,32 @@ def save_label():
             {"Content-Type": "application/json"},
         )
 
-    with open(f"./static/{batch}/labelled/{page_id}.json", "w", encoding="utf-8") as f:
-        json.dump(label, f)
+    registry = load_batch(batch)
+    with metrics.timer("label_write"):
+        label = get_label_journal(batch).write(
+            page_id, label, body.get("add", ()), body.get("remove", ())
+        )
+    get_page_index(batch).set_labelled_num(page_id, len(label))
 
-    if page_id in not_labelled_page_ids_map[batch]:
-        not_labelled_page_ids_map[batch].remove(page_id)
-        labelled_page_ids_map[batch].add(page_id)
+    if page_id in registry:
+        registry.mark_labelled(page_id)
+    elif os.path.exists(f"./static/{batch}/{page_id}.json"):
+        # 扫描 batch 之后才加入的页面
+        registry.add(page_id, labelled=True)
 
-    return {"code": 0, "msg": "success"}, 200, {"Content-Type": "application/json"}
+    return (
+        {"code": 0, "msg": "success", "label": label},
+        200,
+        {"Content-Type": "application/json"},
+    )
 
 
 @app.route("/get/list", methods=["GET"])
 def fetch_list():
+    """
+    page/limit 按页码分页；传 after 时返回 page_id 大于 after 的 limit 个页面，
+    返回中的 next 为下一页的 after，没有下一页时为 null
+    """
     args = request.args
     # -1: all, 0: not labelled, 1: labelled
     filter = int(args.get("filter", -1))
@@ -89,46 +326,45 @@ def fetch_list():
             {"Content-Type": "application/json"},
         )
 
-    page_ids = []
-    if filter == 0:
-        page_ids = list(not_labelled_page_ids_map[batch])
-    elif filter == 1:
-        page_ids = list(labelled_page_ids_map[batch])
-    else:
-        page_ids = list(total_page_ids_map[batch])
-    page_ids.sort()
-    return fetch_list_condition(page_ids, args)
+    registry = load_batch(batch)
+    # 多进程服务时其他 worker 保存的标注
+    registry.refresh(os.path.join(static_dir, batch, "labelled"))
+    return fetch_list_condition(registry, filter, args)
 
 
-def fetch_list_condition(page_ids, args):
-    page_no = int(args.get("page", 1)) - 1
+def fetch_list_condition(registry, filter, args):
     page_sz = int(args.get("limit", 10))
     batch = args.get("batch")
 
     if page_sz < 0:
         page_sz = 10
 
-    total_no = int(len(page_ids) / page_sz)
-    if len(page_ids) % page_sz > 0:
-        total_no += 1
-
-    if total_no - 1 < page_no:
-        page_no = total_no - 1
-
-    st = page_no * page_sz
-    target_ids = page_ids[st : st + page_sz]
-    target_labels, totalNums, validNums, labelledNums = [], [], [], []
-    for target_id in target_ids:
-        totalNum, validNum = handleNodeNum(target_id, batch)
+    if "after" in args:
+        after = args.get("after")
+        target_ids, count, target_labels, st = registry.after(
+            filter, int(after) if after else None, page_sz
+        )
+        page_no = st // page_sz if page_sz else 0
+    else:
+        page_no = int(args.get("page", 1)) - 1
+        count = registry.count(filter)
+        total_no = int(count / page_sz)
+        if count % page_sz > 0:
+            total_no += 1
+
+        if total_no - 1 < page_no:
+            page_no = total_no - 1
+
+        st = page_no * page_sz
+        target_ids, count, target_labels = registry.page(filter, st, page_sz)
+
+    totalNums, validNums, labelledNums = [], [], []
+    counts = get_page_index(batch).get_counts(target_ids)
+    for target_id, target_label in zip(target_ids, target_labels):
+        totalNum, validNum, labelledNum = counts[target_id]
         totalNums.append(totalNum)
         validNums.append(validNum)
-
-        if target_id in not_labelled_page_ids_map[batch]:
-            target_labels.append(0)
-            labelledNums.append(0)
-        if target_id in labelled_page_ids_map[batch]:
-            target_labels.append(1)
-            labelledNums.append(handleLabelledNodeNum(target_id, batch))
+        labelledNums.append(labelledNum if target_label else 0)
 
     data = {
         "code": 0,
@@ -138,7 +374,9 @@ def fetch_list_condition(page_ids, args):
         "total_nums": totalNums,
         "valid_nums": validNums,
         "labelled_nums": labelledNums,
-        "count": len(page_ids),
+        "count": count,
+        "page": page_no + 1,
+        "next": target_ids[-1] if target_ids and st + page_sz < count else None,
     }
 
     response = json.dumps(data)
@@ -146,45 +384,149 @@ def fetch_list_condition(page_ids, args):
 
 
 def handleNodeNum(page_id, batch):
-    extra_bottom = 78 if page_id >= 0 else 168
-    phone_height = 1600 if page_id >= 0 else 2560
-    phone_width = 720 if page_id >= 0 else 1440
-
-    totalNum = validNum = 0
-    with open(f"./static/{batch}/{page_id}.json", "r", encoding="utf-8") as f:
-        nodes = json.load(f)["nodes"]
-    for node in nodes:
-        left, right, top, bottom = (
-            node["screen_left"],
-            node["screen_right"],
-            node["screen_top"],
-            node["screen_bottom"],
+    page_nodes = node_sidecar.load_page_nodes(f"./static/{batch}/{page_id}.json")
+    return len(page_nodes), int(page_nodes.valid(page_id).sum())
+
+
+def handleLabelledNodeNum(page_id, batch):
+    label = get_label_journal(batch).get(page_id)
+    return 0 if label is None else len(label)
+
+
+def prefetch_next_page(batch, page_id):
+    """
+    标注通常按列表顺序进行，提前解码下一页的截图
+    """
+    next_page_id = load_batch(batch).next_page(page_id)
+    if next_page_id is None:
+        return
+
+    image_file, _ = prelabel.page_files(f"./static/{batch}", next_page_id)
+    variants = {}
+    if model_loader.is_ready(["v2"]):
+        variants["v2_screenshot"] = model_loader.get("v2").prepare_screenshot
+    screenshot_cache.prefetch(image_file, variants)
+
+
+def find_pre_labels(batch, page_id, endpoint, cache_key):
+    """
+    先查离线批量预标注的结果，再查请求缓存
+    """
+    with metrics.timer("prelabel_cache_get"):
+        result = get_prelabel_store(batch).get(page_id, endpoint, cache_key)
+        if result is None:
+            result = get_prelabel_cache(batch).get(page_id, endpoint, cache_key)
+    return result
+
+
+def page_rows(page_id, json_file, fields, valid_only):
+    """
+    按 fields 投影后的节点行；bounds 为截掉导航栏和屏幕外部分的 (left, right, top, bottom)，
+    index 为节点在页面 json 中的下标，只返回有效节点时用来还原 father
+    """
+    nodes = prelabel.load_nodes(json_file)
+    page_nodes = node_geometry.PageNodes.from_nodes(nodes)
+    valid = page_nodes.valid(page_id)
+    bounds = page_nodes.clamped_bounds(page_id)
+    if (bounds == np.trunc(bounds)).all():
+        bounds = bounds.astype(np.int64)
+    indices = np.flatnonzero(valid) if valid_only else np.arange(len(nodes))
+
+    computed = {
+        "bounds": bounds[indices].tolist(),
+        "valid": valid[indices].tolist(),
+        "index": indices.tolist(),
+    }
+    columns = [
+        (
+            computed[field]
+            if field in computed
+            else [nodes[i].get(field) for i in computed["index"]]
         )
-        bottom = min(bottom, phone_height - extra_bottom)
-        right = min(right, phone_width)
-        valid = (
-            left >= 0
-            and right >= 0
-            and top >= 0
-            and bottom >= 0
-            and top < phone_height - extra_bottom
-            and left < right
-            and top < bottom
+        for field in fields
+    ]
+    return [list(row) for row in zip(*columns)]
+
+
+@app.route("/get/page", methods=["GET"])
+def get_page():
+    """
+    打开一页需要的全部内容：投影后的节点、当前标注、已缓存的预标注和截图地址
+    fields 为逗号分隔的节点字段，nodes=all 时包括无效节点；
+    prelabels 为逗号分隔的预标注接口（默认 v1,v2），为空时不查预标注；
+    截图 url 会带上请求中的 format / width，对应 /static 的缩略版本
+    """
+    args = request.args
+    page_id = int(args.get("page_id"))
+    batch = args.get("batch")
+
+    if not os.path.exists(f"./static/{batch}"):
+        return (
+            {"code": 1, "msg": f"no such batch: {batch}"},
+            404,
+            {"Content-Type": "application/json"},
         )
 
-        totalNum += 1
-        if valid:
-            validNum += 1
+    dataset_dir = f"./static/{batch}"
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+
+    if not os.path.exists(image_file) or not os.path.exists(json_file):
+        return (
+            {"code": 1, "msg": "no such page"},
+            404,
+            {"Content-Type": "application/json"},
+        )
 
-    return totalNum, validNum
+    fields = args.get("fields")
+    fields = fields.split(",") if fields else page_fields
+    with metrics.timer("page_rows"):
+        rows = page_rows(page_id, json_file, fields, args.get("nodes") != "all")
 
+    load_batch(batch)
+    labels = get_label_journal(batch).get(page_id)
 
-def handleLabelledNodeNum(page_id, batch):
-    json_file = f"./static/{batch}/labelled/{page_id}.json"
-    if not os.path.exists(json_file):
-        return 0
-    with open(json_file, "r", encoding="utf-8") as f:
-        return len(json.load(f))
+    endpoints = args.get("prelabels", "v1,v2").split(",")
+    prelabel_cache = get_prelabel_cache(batch)
+    prelabels = {}
+    for endpoint in ["v1", "v2"]:
+        if endpoint not in endpoints:
+            continue
+        try:
+            version = model_loader.model_version(endpoint)
+        except OSError:
+            # 模型文件不存在时没有可用的预标注
+            prelabels[endpoint] = None
+            continue
+        cache_key = prelabel_cache.key(
+            page_id, endpoint, version, [json_file, image_file]
+        )
+        prelabels[endpoint] = find_pre_labels(batch, page_id, endpoint, cache_key)
+
+    image_name = os.path.basename(image_file)
+    screenshot_url = f"/static/{batch}/{image_name}"
+    variant = {name: args[name] for name in ["format", "width"] if name in args}
+    if variant:
+        screenshot_url += "?" + "&".join(f"{k}={v}" for k, v in variant.items())
+    image_stat = os.stat(image_file)
+
+    data = {
+        "code": 0,
+        "msg": "success",
+        "page_id": page_id,
+        "screen": list(prelabel.screen_size(page_id)),
+        "fields": fields,
+        "nodes": rows,
+        "labels": labels if labels is not None else [],
+        "labelled": labels is not None,
+        "prelabels": prelabels,
+        "screenshot": {
+            "url": screenshot_url,
+            "etag": f'"{static_delivery.etags.get(image_file, image_stat)}"',
+        },
+    }
+    return static_delivery.send_content(
+        json.dumps(data, separators=(",", ":")).encode("utf-8"), request
+    )
 
 
 @app.route("/get/prelabel/algo", methods=["GET"])
@@ -201,12 +543,7 @@ def get_algo_pre_labels():
         )
 
     dataset_dir = f"./static/{batch}"
-    image_file = (
-        f"{dataset_dir}/{page_id}.png"
-        if page_id >= 0
-        else f"{dataset_dir}/{page_id}.jpg"
-    )
-    json_file = f"{dataset_dir}/{page_id}.json"
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
 
     if not os.path.exists(image_file) or not os.path.exists(json_file):
         return (
@@ -214,60 +551,31 @@ def get_algo_pre_labels():
             404,
             {"Content-Type": "application/json"},
         )
-    extra_bottom = 78 if page_id >= 0 else 168
-    phone_height = 1600 if page_id >= 0 else 2560
-    phone_width = 720 if page_id >= 0 else 1440
-
-    page_image = Image.open(image_file)
-    # png 4 通道，转成 rgb
-    if ".png" in image_file:
-        page_image = page_image.convert("RGB")
-    w, h = page_image.size
-    x_ratio = w / phone_width
-    y_ratio = h / phone_height
-    with open(json_file, "r", encoding="utf-8") as f:
-        nodes = json.load(f)["nodes"]
-
-    labels = []
-    for node in nodes:
-        left, right, top, bottom = (
-            node["screen_left"],
-            node["screen_right"],
-            node["screen_top"],
-            node["screen_bottom"],
-        )
-        bottom = min(bottom, phone_height - extra_bottom)
-        right = min(right, phone_width)
-        valid = (
-            left >= 0
-            and right >= 0
-            and top >= 0
-            and bottom >= 0
-            and top < phone_height - extra_bottom
-            and left < right
-            and top < bottom
-        )
-        if not valid:
-            continue
 
-        if (
-            not node["clickable"]
-            and not node["focusable"]
-            and not node["text"]
-            and not node["content_description"]
-        ):
-            continue
+    prelabel_cache = get_prelabel_cache(batch)
+    cache_key = prelabel_cache.key(
+        page_id, "v1", model_loader.model_version("v1"), [json_file, image_file]
+    )
+    prefetch_next_page(batch, page_id)
+    result = find_pre_labels(batch, page_id, "v1", cache_key)
+    if result is not None:
+        return (
+            {"code": 0, "msg": "success", **result},
+            200,
+            {"Content-Type": "application/json"},
+        )
 
-        if online_focus_classifier.pred_model(
-            page_image,
-            coordinator=(
-                int(left * x_ratio),
-                int(right * x_ratio),
-                int(top * y_ratio),
-                int(bottom * y_ratio),
-            ),
-        ):
-            labels.append(node["id"])
+    page_image = screenshot_cache.get(image_file)
+    page_nodes = node_sidecar.load_page_nodes(json_file)
+    with metrics.timer("valid_nodes"):
+        candidates = page_nodes.subset(
+            page_nodes.valid(page_id) & page_nodes.interactive()
+        )
+    preds = model_loader.get("v1").pred_model_batch(
+        page_image, candidates.algo_coordinators(page_id, page_image.size).tolist()
+    )
+    labels = [node_id for node_id, pred in zip(candidates.ids.tolist(), preds) if pred]
+    prelabel_cache.put(page_id, "v1", cache_key, {"labels": labels})
 
     return (
         {"code": 0, "msg": "success", "labels": labels},
@@ -290,12 +598,7 @@ def get_algo_pre_labels_v2():
         )
 
     dataset_dir = f"./static/{batch}"
-    image_file = (
-        f"{dataset_dir}/{page_id}.png"
-        if page_id >= 0
-        else f"{dataset_dir}/{page_id}.jpg"
-    )
-    json_file = f"{dataset_dir}/{page_id}.json"
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
 
     if not os.path.exists(image_file) or not os.path.exists(json_file):
         return (
@@ -303,58 +606,43 @@ def get_algo_pre_labels_v2():
             404,
             {"Content-Type": "application/json"},
         )
-    extra_bottom = 78 if page_id >= 0 else 168
-    phone_height = 1600 if page_id >= 0 else 2560
-    phone_width = 720 if page_id >= 0 else 1440
-
-    page_image = Image.open(image_file)
-    # png 4 通道，转成 rgb
-    if ".png" in image_file:
-        page_image = page_image.convert("RGB")
-    w, h = page_image.size
-    x_ratio = w / phone_width
-    y_ratio = h / phone_height
-    with open(json_file, "r", encoding="utf-8") as f:
-        nodes = json.load(f)["nodes"]
-
-    valid_nodes = []
-    labels = []
-    for node in nodes:
-        left, right, top, bottom = (
-            node["screen_left"],
-            node["screen_right"],
-            node["screen_top"],
-            node["screen_bottom"],
-        )
-        bottom = min(bottom, phone_height - extra_bottom)
-        right = min(right, phone_width)
-        valid = (
-            left >= 0
-            and right >= 0
-            and top >= 0
-            and bottom >= 0
-            and top < phone_height - extra_bottom
-            and left < right
-            and top < bottom
+
+    prelabel_cache = get_prelabel_cache(batch)
+    cache_key = prelabel_cache.key(
+        page_id, "v2", model_loader.model_version("v2"), [json_file, image_file]
+    )
+    prefetch_next_page(batch, page_id)
+    result = find_pre_labels(batch, page_id, "v2", cache_key)
+    if result is not None:
+        return (
+            {"code": 0, "msg": "success", **result},
+            200,
+            {"Content-Type": "application/json"},
         )
-        if not valid:
-            continue
 
-        node["algo_coordinator"] = [
-            int(left * x_ratio),
-            int(right * x_ratio),
-            int(top * y_ratio),
-            int(bottom * y_ratio),
-        ]
-        node["normal_algo_cooridnator"] = [
-            left / phone_width,
-            right / phone_width,
-            top / phone_height,
-            bottom / phone_height,
-        ]
-        valid_nodes.append(node)
-
-    labels, probs = a11y_mlp_classifier.pred_model(page_image, valid_nodes)
+    page_image = screenshot_cache.get(image_file)
+    page_nodes = node_sidecar.load_page_nodes(json_file)
+    with metrics.timer("valid_nodes"):
+        page_nodes = page_nodes.subset(page_nodes.valid(page_id))
+    classifier = model_loader.get("v2")
+    # 开启 cascade 时只有小模型不确定的节点交给完整模型
+    results, escalate = classifier.cascade_split(page_nodes, page_id)
+    page = classifier.prepare_page(
+        page_image,
+        page_id,
+        page_nodes.subset(escalate),
+        screenshot_cache.get_variant(
+            image_file, "v2_screenshot", classifier.prepare_screenshot
+        ),
+    )
+    with metrics.timer("v2_scheduler"):
+        escalated = v2_scheduler.submit(
+            page, len(escalate), group=tuple(page["screenshot"].shape)
+        )
+    for i, result in zip(escalate, escalated):
+        results[i] = result
+    labels, probs = classifier.page_labels(page_nodes.ids.tolist(), results)
+    prelabel_cache.put(page_id, "v2", cache_key, {"labels": labels, "probs": probs})
 
     return (
         {"code": 0, "msg": "success", "labels": labels, "probs": probs},
@@ -363,5 +651,251 @@ def get_algo_pre_labels_v2():
     )
 
 
+def stream_chunks(total, first, size):
+    """
+    流式预标注的分段 (start, end)，第一段 first 个节点，之后每段 size 个
+    """
+    start = 0
+    while start < total:
+        end = min(total, start + (first if start == 0 else size))
+        yield start, end
+        start = end
+
+
+def stream_response(events):
+    """
+    events 产出 (事件名, dict)；请求 Accept text/event-stream 或 format=sse 时
+    以 server-sent events 发送，否则每行一个 json（NDJSON），事件名放在 event 字段
+    """
+    sse = (
+        request.args.get("format") == "sse"
+        or request.accept_mimetypes.best == "text/event-stream"
+    )
+
+    def generate():
+        try:
+            for event, data in events:
+                if sse:
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                else:
+                    yield json.dumps({"event": event, **data}) + "\n"
+        except Exception as e:
+            # 响应头已经发出，只能以事件的形式报告错误
+            app.logger.exception("prelabel stream failed")
+            data = {"code": 1, "msg": repr(e)}
+            if sse:
+                yield f"event: error\ndata: {json.dumps(data)}\n\n"
+            else:
+                yield json.dumps({"event": "error", **data}) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        # 不让 nginx 等反向代理缓冲
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def stream_algo_pre_labels(batch, page_id, image_file, json_file, cache_key):
+    page_image = screenshot_cache.get(image_file)
+    page_nodes = node_sidecar.load_page_nodes(json_file)
+    with metrics.timer("valid_nodes"):
+        candidates = page_nodes.subset(
+            page_nodes.valid(page_id) & page_nodes.interactive()
+        )
+    order = candidates.priority()
+    node_ids = candidates.ids[order].tolist()
+    coordinators = candidates.algo_coordinators(page_id, page_image.size)[order]
+    model = model_loader.get("v1")
+
+    preds = [False] * len(candidates)
+    for start, end in stream_chunks(len(order), stream_first_nodes, model.batch_size):
+        chunk = model.pred_model_batch(page_image, coordinators[start:end].tolist())
+        for i, pred in zip(order[start:end], chunk):
+            preds[i] = pred
+        yield "labels", {
+            "labels": [
+                node_id for node_id, pred in zip(node_ids[start:end], chunk) if pred
+            ],
+            "scored": end,
+            "total": len(order),
+        }
+
+    # 与 /get/prelabel/algo 的结果相同，按节点顺序
+    labels = [node_id for node_id, pred in zip(candidates.ids.tolist(), preds) if pred]
+    get_prelabel_cache(batch).put(page_id, "v1", cache_key, {"labels": labels})
+    yield "done", {"labels": labels, "scored": len(order), "total": len(order)}
+
+
+def stream_algo_pre_labels_v2(batch, page_id, image_file, json_file, cache_key):
+    page_image = screenshot_cache.get(image_file)
+    page_nodes = node_sidecar.load_page_nodes(json_file)
+    with metrics.timer("valid_nodes"):
+        page_nodes = page_nodes.subset(page_nodes.valid(page_id))
+    classifier = model_loader.get("v2")
+    total = len(page_nodes)
+
+    results, escalate = classifier.cascade_split(page_nodes, page_id)
+    scored = total - len(escalate)
+    if scored:
+        # cascade 的小模型已确定的节点先发送
+        decided = [i for i, result in enumerate(results) if result is not None]
+        labels, probs = classifier.page_labels(
+            page_nodes.ids[decided].tolist(), [results[i] for i in decided]
+        )
+        yield "labels", {
+            "labels": labels,
+            "probs": probs,
+            "scored": scored,
+            "total": total,
+        }
+
+    escalated = page_nodes.subset(escalate)
+    order = escalated.priority()
+    ordered = escalated.subset(order)
+    positions = escalate[order]
+    screenshot = screenshot_cache.get_variant(
+        image_file, "v2_screenshot", classifier.prepare_screenshot
+    )
+
+    def submit(start, end):
+        page = classifier.prepare_page(
+            page_image, page_id, ordered.subset(slice(start, end)), screenshot
+        )
+        return v2_scheduler.submit_async(
+            page, end - start, group=tuple(page["screenshot"].shape)
+        )
+
+    chunks = list(
+        stream_chunks(len(order), stream_first_nodes, v2_scheduler.batch_size)
+    )
+    # 第一段单独成批，算完后再一次提交其余各段，由调度器按顺序攒批
+    submitted = [submit(start, end) for start, end in chunks[:1]]
+    for index, (start, end) in enumerate(chunks):
+        chunk = v2_scheduler.wait(submitted[index])
+        if index == 0:
+            submitted += [submit(start, end) for start, end in chunks[1:]]
+        for i, result in zip(positions[start:end], chunk):
+            results[i] = result
+        labels, probs = classifier.page_labels(ordered.ids[start:end].tolist(), chunk)
+        yield "labels", {
+            "labels": labels,
+            "probs": probs,
+            "scored": scored + end,
+            "total": total,
+        }
+
+    # 与 /get/prelabel/algo/v2 的结果相同，按节点顺序
+    labels, probs = classifier.page_labels(page_nodes.ids.tolist(), results)
+    get_prelabel_cache(batch).put(
+        page_id, "v2", cache_key, {"labels": labels, "probs": probs}
+    )
+    yield "done", {"labels": labels, "probs": probs, "scored": total, "total": total}
+
+
+def stream_pre_labels_endpoint(endpoint, stream):
+    args = request.args
+    page_id = int(args.get("page_id"))
+    batch = args.get("batch")
+
+    if not os.path.exists(f"./static/{batch}"):
+        return (
+            {"code": 1, "msg": f"no such batch: {batch}"},
+            404,
+            {"Content-Type": "application/json"},
+        )
+
+    dataset_dir = f"./static/{batch}"
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+
+    if not os.path.exists(image_file) or not os.path.exists(json_file):
+        return (
+            {"code": 1, "msg": "no such page"},
+            404,
+            {"Content-Type": "application/json"},
+        )
+
+    cache_key = get_prelabel_cache(batch).key(
+        page_id, endpoint, model_loader.model_version(endpoint), [json_file, image_file]
+    )
+    prefetch_next_page(batch, page_id)
+    result = find_pre_labels(batch, page_id, endpoint, cache_key)
+    if result is not None:
+        return stream_response(iter([("done", {**result, "cached": True})]))
+
+    return stream_response(stream(batch, page_id, image_file, json_file, cache_key))
+
+
+@app.route("/get/prelabel/algo/stream", methods=["GET"])
+def stream_pre_labels():
+    """
+    v1 预标注的流式版本，先算可点击/可聚焦的节点，每算完一段发送一个 labels 事件
+    （本段的正例），最后的 done 事件为完整结果；已缓存时只发送 done
+    """
+    return stream_pre_labels_endpoint("v1", stream_algo_pre_labels)
+
+
+@app.route("/get/prelabel/algo/v2/stream", methods=["GET"])
+def stream_pre_labels_v2():
+    """
+    v2 预标注的流式版本，labels 事件带本段的 labels 和 probs
+    """
+    return stream_pre_labels_endpoint("v2", stream_algo_pre_labels_v2)
+
+
+@app.route("/static/<path:filename>", methods=["GET"])
+def get_static(filename):
+    file = safe_join(static_dir, filename)
+    if file is None or not os.path.isfile(file):
+        return (
+            {"code": 1, "msg": "not found"},
+            404,
+            {"Content-Type": "application/json"},
+        )
+
+    parts = filename.split("/")
+    if len(parts) == 3 and parts[1] == "labelled" and parts[2].endswith(".json"):
+        # 标注以标注日志为准，包括尚未合并到文件的修改
+        try:
+            page_id = int(parts[2][: -len(".json")])
+        except ValueError:
+            page_id = None
+        if page_id is not None:
+            load_batch(parts[0])
+            label = get_label_journal(parts[0]).get(page_id)
+            if label is not None:
+                return static_delivery.send_content(
+                    json.dumps(label).encode("utf-8"), request
+                )
+
+    if file.endswith(".json"):
+        return static_delivery.send_json(file, request)
+    if file.endswith((".png", ".jpg")):
+        return static_delivery.send_image(file, request)
+    return static_delivery.send(file)
+
+
+@app.route("/get/scheduler", methods=["GET"])
+def get_scheduler():
+    return (
+        {"code": 0, "msg": "success", "v2": v2_scheduler.stats()},
+        200,
+        {"Content-Type": "application/json"},
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return (
+        metrics.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
 if __name__ == "__main__":
+    # 开发用的单进程 debug 模式，生产环境使用 serve.py
+    # debug 模式下 reloader 的父进程不处理请求，只在实际服务的子进程里预热
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model_loader.warm_up(warm_up_models, before=load_all_page)
     app.run(debug=True, port=15000, host="0.0.0.0")
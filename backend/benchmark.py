@@ -0,0 +1,401 @@
+"""
+在临时 static/ 目录下生成模拟数据并测量各接口耗时，结果保存为 json，用法：
+
+    python benchmark.py --pages 500 --nodes 80 --output before.json
+    python benchmark.py --pages 500 --nodes 80 --baseline before.json
+
+--models stub 时模型输出为固定规则，只测预处理和接口本身；
+--models cpu 时在 CPU 上加载真实模型（需要模型文件）
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+from PIL import Image
+
+words = [
+    "ok",
+    "cancel",
+    "settings",
+    "search",
+    "home",
+    "back",
+    "more",
+    "share",
+    "like",
+    "comment",
+    "download",
+    "profile",
+    "message",
+    "notification",
+    "play",
+    "pause",
+]
+class_names = [
+    "android.widget.TextView",
+    "android.widget.ImageView",
+    "android.widget.Button",
+    "android.widget.FrameLayout",
+    "android.widget.LinearLayout",
+    "androidx.recyclerview.widget.RecyclerView",
+]
+
+
+def random_text(rng, max_words):
+    if rng.random() < 0.4:
+        return ""
+    return " ".join(rng.choice(words) for _ in range(rng.randint(1, max_words)))
+
+
+def random_node(rng, node_id, phone_width, phone_height, text_length):
+    # 约 10% 的节点坐标无效
+    left = rng.randint(-20 if rng.random() < 0.1 else 0, phone_width - 10)
+    top = rng.randint(0, phone_height)
+    return {
+        "id": node_id,
+        "screen_left": left,
+        "screen_right": left + rng.randint(-5, phone_width // 2),
+        "screen_top": top,
+        "screen_bottom": top + rng.randint(-5, phone_height // 8),
+        "class_name": rng.choice(class_names),
+        "view_id_resource_name": (
+            f"com.example:id/{rng.choice(words)}" if rng.random() < 0.5 else None
+        ),
+        "text": random_text(rng, text_length),
+        "content_description": random_text(rng, text_length),
+        "clickable": rng.random() < 0.3,
+        "focusable": rng.random() < 0.3,
+        "checkable": rng.random() < 0.05,
+        "checked": False,
+        "focused": False,
+        "selected": rng.random() < 0.05,
+        "long_clickable": rng.random() < 0.1,
+        "context_clickable": False,
+        "enabled": rng.random() < 0.9,
+    }
+
+
+def generate_batch(
+    dataset_dir, pages, nodes, negative_fraction, text_length, labelled_fraction, seed
+):
+    """
+    生成 pages 个页面：负数 page_id 为 1440x2560 的 jpg，正数为 720x1600 的 png，
+    每页 nodes 个节点，labelled_fraction 比例的页面带标注
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(dataset_dir, "labelled"), exist_ok=True)
+
+    negatives = int(pages * negative_fraction)
+    page_ids = [-i - 1 for i in range(negatives)] + list(range(pages - negatives))
+    for page_id in page_ids:
+        phone_width, phone_height = (720, 1600) if page_id >= 0 else (1440, 2560)
+        page_nodes = [
+            random_node(rng, i, phone_width, phone_height, text_length)
+            for i in range(nodes)
+        ]
+        with open(f"{dataset_dir}/{page_id}.json", "w", encoding="utf-8") as f:
+            json.dump({"nodes": page_nodes}, f)
+
+        # 低分辨率噪声放大，编码速度和文件大小接近真实截图
+        image = Image.fromarray(
+            np_rng.integers(
+                0, 256, (phone_height // 16, phone_width // 16, 3), dtype=np.uint8
+            )
+        ).resize((phone_width, phone_height))
+        image.save(f"{dataset_dir}/{page_id}.{'png' if page_id >= 0 else 'jpg'}")
+
+        if rng.random() < labelled_fraction:
+            label = [node["id"] for node in page_nodes if rng.random() < 0.2]
+            with open(
+                f"{dataset_dir}/labelled/{page_id}.json", "w", encoding="utf-8"
+            ) as f:
+                json.dump(label, f)
+    return page_ids
+
+
+def stub_models(model_loader):
+    """
+    用固定规则代替模型推理，预处理仍使用真实代码
+    """
+    import a11y_mlp_classifier
+    import online_focus_classifier
+
+    v1 = types.ModuleType("benchmark_stub_v1")
+    v1.model_version = lambda: "stub"
+    v1.get_model = lambda: None
+    v1.pred_model_batch = lambda image, coordinators: [
+        bool(crop.mean() % 2 > 1)
+        for crop in online_focus_classifier.prepare_crops(image, coordinators)
+    ]
+
+    v2 = types.ModuleType("benchmark_stub_v2")
+    v2.model_version = lambda: "stub"
+    v2.get_model = lambda: None
+    v2.prepare_screenshot = a11y_mlp_classifier.prepare_screenshot
+    v2.prepare_page = a11y_mlp_classifier.prepare_page
+    v2.page_labels = a11y_mlp_classifier.page_labels
+    # 全部节点交给 pred_segments，同 cascade 关闭时
+    v2.cascade_split = lambda page_nodes, page_id: (
+        [None] * len(page_nodes),
+        np.arange(len(page_nodes)),
+    )
+    v2.pred_segments = lambda segments: [
+        (0.5 + (start + i) % 50 / 100, int((start + i) % 3 == 0))
+        for page, start, end in segments
+        for i in range(min(end, len(page["node_ids"])) - start)
+    ]
+
+    for name, module in [("v1", v1), ("v2", v2)]:
+        sys.modules[module.__name__] = module
+        model_loader.loaders[name] = model_loader.ModelLoader(module.__name__)
+
+
+def resolve_model_paths():
+    """
+    模型文件的默认路径相对于当前目录，chdir 到临时目录之前先转成绝对路径
+    """
+    import a11y_mlp_classifier
+    import online_focus_classifier
+
+    config = a11y_mlp_classifier.config
+    online_focus_classifier.weight_path = os.path.abspath(
+        online_focus_classifier.weight_path
+    )
+    online_focus_classifier.engine_file = os.path.abspath(
+        online_focus_classifier.engine_file
+    )
+    for name in ["checkpoint_file", "engine_dir", "cascade_checkpoint_file"]:
+        setattr(config, name, os.path.abspath(getattr(config, name)))
+
+
+def use_cpu():
+    import a11y_mlp_classifier
+    import online_focus_classifier
+    import torch
+
+    online_focus_classifier.device = torch.device("cpu")
+    a11y_mlp_classifier.config.device = torch.device("cpu")
+
+
+def summarize(seconds):
+    seconds = np.array(seconds)
+    ms = seconds * 1000
+    return {
+        "count": len(seconds),
+        "throughput": round(len(seconds) / seconds.sum(), 3) if seconds.sum() else None,
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def measure(func, times):
+    seconds = []
+    for i in range(times):
+        start = time.perf_counter()
+        func(i)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)}")
+    return response
+
+
+def run(args, root):
+    batch = "bench0"
+    dataset_dir = os.path.join(root, "static", batch)
+    print(f"generating {args.pages} pages under {dataset_dir}")
+    start = time.perf_counter()
+    page_ids = generate_batch(
+        dataset_dir,
+        args.pages,
+        args.nodes,
+        args.negative_fraction,
+        args.text_length,
+        args.labelled_fraction,
+        args.seed,
+    )
+    print(f"  done in {time.perf_counter() - start:.1f}s")
+
+    # app 里既有基于 __file__ 的 static_dir，也有相对当前目录的 ./static
+    resolve_model_paths()
+    os.chdir(root)
+    import app as server
+    import model_loader
+
+    server.static_dir = os.path.join(root, "static")
+    if args.models == "stub":
+        stub_models(model_loader)
+    else:
+        use_cpu()
+
+    client = server.app.test_client()
+    rng = random.Random(args.seed)
+    results = {}
+
+    def reset():
+        server.page_registries.clear()
+
+    def load_all_page(i):
+        reset()
+        server.load_all_page()
+
+    results["load_all_page"] = measure(load_all_page, args.repeat)
+
+    limit = 10
+    for name, filter in [("all", -1), ("not_labelled", 0), ("labelled", 1)]:
+        pages = max(1, args.pages // limit)
+        results[f"get_list_{name}"] = measure(
+            lambda i: check(
+                client.get(
+                    "/get/list",
+                    query_string={
+                        "batch": batch,
+                        "filter": filter,
+                        "page": rng.randint(1, pages),
+                        "limit": limit,
+                    },
+                )
+            ),
+            args.requests,
+        )
+
+    # 按 after 翻页，每次从随机页面之后开始
+    results["get_list_cursor"] = measure(
+        lambda i: check(
+            client.get(
+                "/get/list",
+                query_string={
+                    "batch": batch,
+                    "after": rng.choice(page_ids),
+                    "limit": limit,
+                },
+            )
+        ),
+        args.requests,
+    )
+
+    results["handle_node_num"] = measure(
+        lambda i: server.handleNodeNum(rng.choice(page_ids), batch), args.requests
+    )
+
+    def post_label(i):
+        check(
+            client.post(
+                "/post/label",
+                json={
+                    "batch": batch,
+                    "page_id": rng.choice(page_ids),
+                    "label": rng.sample(range(args.nodes), min(args.nodes, 10)),
+                },
+            )
+        )
+
+    results["post_label"] = measure(post_label, args.requests)
+
+    # 先用不同页面测未命中缓存的情况，再重复请求同样的页面测命中缓存
+    prelabel_pages = page_ids[: args.prelabel_requests]
+    for endpoint, url in [
+        ("v1", "/get/prelabel/algo"),
+        ("v2", "/get/prelabel/algo/v2"),
+    ]:
+        for name in ["miss", "hit"]:
+            results[f"prelabel_{endpoint}_{name}"] = measure(
+                lambda i: check(
+                    client.get(
+                        url, query_string={"batch": batch, "page_id": prelabel_pages[i]}
+                    )
+                ),
+                len(prelabel_pages),
+            )
+
+    return {name: summarize(seconds) for name, seconds in results.items()}
+
+
+def compare(results, baseline):
+    print(f"{'':24}{'p50 ms':>28}{'p95 ms':>28}{'p99 ms':>28}")
+    for name, stats in results.items():
+        line = f"{name:24}"
+        for key in ["p50_ms", "p95_ms", "p99_ms"]:
+            value = f"{stats[key]:.2f}"
+            if name in baseline:
+                before = baseline[name][key]
+                change = (stats[key] - before) / before * 100 if before else 0
+                value = f"{before:.2f} -> {value} ({change:+.0f}%)"
+            line += f"{value:>28}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--nodes", type=int, default=60)
+    # page_id 为负数（1440x2560）的页面比例
+    parser.add_argument("--negative-fraction", type=float, default=0.3)
+    # 文本和 content description 的最大单词数
+    parser.add_argument("--text-length", type=int, default=8)
+    parser.add_argument("--labelled-fraction", type=float, default=0.5)
+    parser.add_argument("--models", choices=["stub", "cpu"], default="stub")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--prelabel-requests", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    # 保留生成的临时目录
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    output = os.path.abspath(
+        args.output or time.strftime("benchmark-%Y%m%d-%H%M%S.json")
+    )
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    root = tempfile.mkdtemp(prefix="a11y-benchmark-")
+    cwd = os.getcwd()
+    try:
+        results = run(args, root)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"kept {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "args": vars(args),
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    compare(results, baseline or {})
+    print(f"saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+把已标注的页面导出为训练数据集，用法：
+
+    python export_dataset.py batch0 batch1 --output ../../../my_dataset/a11y
+
+输出 <output>/hierarchy/<index>.json（节点带 focusable_manual_label）和
+<output>/screenshot/<index>.png，page_id 与 index 的对应关系写在
+static/<batch>/labelled/file_map.json，已导出的页面保持原来的 index，
+新页面从输出目录中已有的最大 index 之后编号，分开导出的 batch 也不会重复；
+页面 json、截图和标注文件都没变化的页面会跳过
+--shards 时另外生成 <output>/shards 下的训练分片，见 training_shards.py
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import prelabel
+
+static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+default_output = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../../../my_dataset/a11y"
+)
+start_index = 1000000
+# linux 上的 FICLONE，文件系统支持时共享数据块（reflink）
+ficlone = 0x40049409
+
+
+def labelled_page_ids(dataset_dir):
+    page_ids = []
+    for label_file in os.listdir(os.path.join(dataset_dir, "labelled")):
+        # 与原 build.py 一致：跳过 file_map 和文件名带 "-" 的标注
+        if ".json" not in label_file or "-" in label_file or "file_map" in label_file:
+            continue
+        page_ids.append(int(label_file.split(".")[0]))
+    page_ids.sort()
+    return page_ids
+
+
+def files_identity(files):
+    identity = []
+    for file in files:
+        stat = os.stat(file)
+        identity += [stat.st_size, stat.st_mtime_ns]
+    return identity
+
+
+def page_sources(dataset_dir, page_id):
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+    label_file = os.path.join(dataset_dir, "labelled", f"{page_id}.json")
+    return image_file, json_file, label_file
+
+
+def output_files(output, index, image_file):
+    return (
+        os.path.join(output, "hierarchy", f"{index}.json"),
+        os.path.join(output, "screenshot", f"{index}{os.path.splitext(image_file)[1]}"),
+    )
+
+
+def link_or_copy(src, dst):
+    """
+    优先硬链接，其次 reflink，都不支持时复制
+    """
+    # 已经是同一个文件的硬链接时 rename 不会生效，直接跳过
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    tmp_file = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp_file)
+    except OSError:
+        try:
+            with open(src, "rb") as fsrc, open(tmp_file, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), ficlone, fsrc.fileno())
+        except OSError:
+            shutil.copyfile(src, tmp_file)
+    os.replace(tmp_file, dst)
+
+
+def export_page(dataset_dir, page_id, index, output):
+    """
+    在 worker 进程中导出一页，返回写入的字节数
+    """
+    image_file, json_file, label_file = page_sources(dataset_dir, page_id)
+    with open(json_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    with open(label_file, "r", encoding="utf-8") as f:
+        labels = set(json.load(f))
+
+    for node in data["nodes"]:
+        node["focusable_manual_label"] = node["id"] in labels
+
+    hierarchy_file, screenshot_file = output_files(output, index, image_file)
+    content = json.dumps(data).encode("utf-8")
+    tmp_file = f"{hierarchy_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+    os.replace(tmp_file, hierarchy_file)
+    link_or_copy(image_file, screenshot_file)
+    return len(content) + os.path.getsize(image_file)
+
+
+def read_json(file, default):
+    try:
+        with open(file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(file, data):
+    tmp_file = f"{file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_file, file)
+
+
+def max_output_index(output):
+    """
+    输出目录中已导出页面的最大 index，包括之前单独导出的其他 batch
+    """
+    indexes = [start_index - 1]
+    for name in ["hierarchy", "screenshot"]:
+        for file in os.listdir(os.path.join(output, name)):
+            stem = file.split(".")[0]
+            if stem.isdigit():
+                indexes.append(int(stem))
+    return max(indexes)
+
+
+def plan_batch(batch, output, next_index, force):
+    """
+    返回 (file_map, sources, 待导出的 [(page_id, index)], 跳过的页数, 下一个 index)
+    sources 记录导出时各源文件的 (大小, mtime)，用来判断是否需要重新导出
+    """
+    dataset_dir = os.path.join(static_dir, batch)
+    labelled_dir = os.path.join(dataset_dir, "labelled")
+    old_file_map = read_json(os.path.join(labelled_dir, "file_map.json"), {})
+    old_sources = read_json(os.path.join(labelled_dir, "file_map.sources.json"), {})
+    if old_sources.get("output") != os.path.abspath(output):
+        old_sources = {}
+    old_pages = old_sources.get("pages", {})
+
+    file_map, pages, tasks, skipped = {}, {}, [], 0
+    for page_id in labelled_page_ids(dataset_dir):
+        key = str(page_id)
+        sources = page_sources(dataset_dir, page_id)
+        try:
+            identity = files_identity(sources)
+        except FileNotFoundError as e:
+            print(f"  {batch} page {page_id} skipped: {e.filename} not found")
+            continue
+
+        index = old_file_map.get(key)
+        if index is None:
+            index, next_index = next_index, next_index + 1
+        file_map[key] = index
+        pages[key] = identity
+
+        unchanged = (
+            not force
+            and old_pages.get(key) == identity
+            and all(os.path.exists(f) for f in output_files(output, index, sources[0]))
+        )
+        if unchanged:
+            skipped += 1
+        else:
+            tasks.append((page_id, index))
+
+    removed = len(set(old_file_map) - set(file_map))
+    if removed:
+        print(f"  {batch}: {removed} pages no longer labelled, exported files kept")
+    return file_map, pages, tasks, skipped, next_index
+
+
+def export_shards(executor, output, batches, sources, force, shard_nodes, embeddings):
+    """
+    把所有已导出的页面写成 <output>/shards 下的训练分片，源文件都没变化时跳过
+    sources: {batch: {page_id: 源文件的 (大小, mtime)}}
+    """
+    # 只有 --shards 时才需要，避免普通导出也加载 torch
+    import training_shards
+
+    root = os.path.join(output, "shards")
+    manifest = training_shards.read_manifest(root)
+    if (
+        not force
+        and manifest is not None
+        and manifest["sources"] == sources
+        and bool(manifest["text_embeddings"]) == embeddings
+    ):
+        print(f"shards: up to date, {manifest['nodes']} nodes")
+        return
+
+    start = time.perf_counter()
+    writer = training_shards.ShardWriter(root, batches, shard_nodes)
+    for batch_no, batch in enumerate(batches):
+        dataset_dir = os.path.join(static_dir, batch)
+        file_map = read_json(os.path.join(dataset_dir, "labelled", "file_map.json"), {})
+        page_ids = sorted(int(page_id) for page_id in sources[batch])
+        futures = [
+            (
+                page_id,
+                executor.submit(training_shards.page_features, dataset_dir, page_id),
+            )
+            for page_id in page_ids
+        ]
+        for page_id, future in futures:
+            try:
+                features = future.result()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"  {batch} page {page_id} failed: {e!r}")
+                sources[batch].pop(str(page_id))
+                continue
+            writer.add(batch_no, page_id, file_map[str(page_id)], features)
+
+    manifest = writer.close(sources, embeddings)
+    elapsed = time.perf_counter() - start
+    print(
+        f"shards: {manifest['pages']} pages, {manifest['nodes']} nodes, "
+        f"{manifest['texts']} texts in {len(manifest['shards'])} shards "
+        f"in {elapsed:.1f}s: {manifest['pages'] / elapsed:.1f} pages/s"
+    )
+
+
+def run(
+    batches,
+    output,
+    workers,
+    force,
+    shards=False,
+    shard_nodes=1 << 20,
+    embeddings=False,
+):
+    for name in ["hierarchy", "screenshot"]:
+        os.makedirs(os.path.join(output, name), exist_ok=True)
+
+    # 已有 index 保持不变，新页面从输出目录和各 batch 中最大的 index 之后编号
+    next_index = max_output_index(output) + 1
+    for batch in batches:
+        file_map = read_json(
+            os.path.join(static_dir, batch, "labelled", "file_map.json"), {}
+        )
+        next_index = max([next_index] + [index + 1 for index in file_map.values()])
+
+    start = time.perf_counter()
+    exported = total_bytes = total_skipped = 0
+    sources = {}
+    with ProcessPoolExecutor(workers) as executor:
+        for batch in batches:
+            dataset_dir = os.path.join(static_dir, batch)
+            file_map, pages, tasks, skipped, next_index = plan_batch(
+                batch, output, next_index, force
+            )
+            print(f"{batch}: {len(tasks)} pages to export, {skipped} unchanged")
+            total_skipped += skipped
+
+            futures = [
+                (
+                    page_id,
+                    executor.submit(export_page, dataset_dir, page_id, index, output),
+                )
+                for page_id, index in tasks
+            ]
+            for page_id, future in futures:
+                try:
+                    total_bytes += future.result()
+                    exported += 1
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"  {batch} page {page_id} failed: {e!r}")
+                    # 下次运行时重新导出
+                    pages.pop(str(page_id), None)
+
+            labelled_dir = os.path.join(dataset_dir, "labelled")
+            write_json(os.path.join(labelled_dir, "file_map.json"), file_map)
+            write_json(
+                os.path.join(labelled_dir, "file_map.sources.json"),
+                {"output": os.path.abspath(output), "pages": pages},
+            )
+            sources[batch] = pages
+
+        elapsed = time.perf_counter() - start
+        print(
+            f"exported {exported} pages, skipped {total_skipped} in {elapsed:.1f}s: "
+            f"{exported / elapsed:.1f} pages/s, {total_bytes / elapsed / 1e6:.1f} MB/s"
+        )
+        if shards:
+            export_shards(
+                executor, output, batches, sources, force, shard_nodes, embeddings
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("batches", nargs="+")
+    parser.add_argument("--output", default=default_output)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    # 忽略上次导出的记录，全部重新导出
+    parser.add_argument("--force", action="store_true")
+    # 同时生成训练用的分片，见 training_shards.py
+    parser.add_argument("--shards", action="store_true")
+    parser.add_argument("--shard-nodes", type=int, default=1 << 20)
+    # 分片中附带用当前 v2 模型计算的文本 embedding
+    parser.add_argument("--text-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    run(
+        args.batches,
+        args.output,
+        args.workers,
+        args.force,
+        args.shards,
+        args.shard_nodes,
+        args.text_embeddings,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+把分类器导出为 TorchScript 模型，用法：
+
+    python export_engine.py v1 v2
+
+导出后将 online_focus_classifier.backend 或 a11y_mlp_classifier 的
+Config.backend 设为 "torchscript" 即可加载导出的模型，
+一致性检查：python parity_check.py engine
+"""
+
+import argparse
+import json
+import os
+
+import a11y_mlp_classifier
+import online_focus_classifier
+import torch
+import torch.nn as nn
+
+
+class TextEncoder(nn.Module):
+    # 只保留 BERT，输入 input_ids、attention_mask，输出 [CLS] embedding
+    forward = a11y_mlp_classifier.MLPModel.text_cls
+
+    def __init__(self, model):
+        super().__init__()
+        self.text_pretrained_model = model.text_pretrained_model
+
+
+class Classifier(nn.Module):
+    # 文本、截图、属性 embedding 之后的三个 MLP
+    forward = a11y_mlp_classifier.MLPModel.classify
+
+    def __init__(self, model):
+        super().__init__()
+        self.text_mlp_model = model.text_mlp_model
+        self.attribute_mlp_model = model.attribute_mlp_model
+        self.mlp_model = model.mlp_model
+
+
+def save_traced(module, example_inputs, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(module.eval(), example_inputs)
+    torch.jit.save(traced, path)
+    print(f"  saved {path}")
+
+
+def export_v1(engine_file):
+    online_focus_classifier.backend = "eager"
+    model = online_focus_classifier.load_model()
+    example = torch.zeros((2, 3, 224, 224), device=online_focus_classifier.device)
+    save_traced(model, example, engine_file)
+
+
+def export_v2(engine_dir):
+    config = a11y_mlp_classifier.config
+    config.backend = "eager"
+    model = a11y_mlp_classifier.build_model()
+    os.makedirs(engine_dir, exist_ok=True)
+
+    # 示例输入带 padding，保证 attention_mask 参与计算
+    encoded = model.tokenizer(
+        ["none", "a longer example text for tracing"],
+        padding=True,
+        return_tensors="pt",
+    ).to(config.device)
+    save_traced(
+        TextEncoder(model),
+        (encoded["input_ids"], encoded["attention_mask"]),
+        os.path.join(engine_dir, "text_encoder.pt"),
+    )
+
+    image = torch.zeros((2, 4, 568, 256), device=config.device)
+    if config.device.type == "cpu" and config.cpu_channels_last:
+        image = image.contiguous(memory_format=torch.channels_last)
+    save_traced(
+        model.vision_pretrained_model,
+        image,
+        os.path.join(engine_dir, "vision_encoder.pt"),
+    )
+
+    save_traced(
+        Classifier(model),
+        (
+            torch.zeros((2, config.text_mlp_input_dim), device=config.device),
+            torch.zeros((2, config.image_dim), device=config.device),
+            torch.zeros((2, config.attribute_mlp_input_dim), device=config.device),
+        ),
+        os.path.join(engine_dir, "classifier.pt"),
+    )
+
+    model.tokenizer.save_pretrained(engine_dir)
+    with open(os.path.join(engine_dir, "engine.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "model_version": a11y_mlp_classifier.model_version(),
+                "text_pretrained_name": config.text_pretrained_name,
+                "text_max_length": config.text_max_length,
+                "quantized": a11y_mlp_classifier.quantized(),
+                "device": str(config.device),
+            },
+            f,
+            indent=2,
+        )
+    print(f"  saved {engine_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("models", nargs="+", choices=["v1", "v2"])
+    parser.add_argument("--v1-output", default=online_focus_classifier.engine_file)
+    parser.add_argument("--v2-output", default=a11y_mlp_classifier.config.engine_dir)
+    args = parser.parse_args()
+
+    if "v1" in args.models:
+        print("exporting v1")
+        export_v1(args.v1_output)
+    if "v2" in args.models:
+        print("exporting v2")
+        export_v2(args.v2_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import deque
+
+
+class NodeQueue:
+    """
+    跨页面攒批，凑够 batch_size 个节点跑一次模型
+    """
+
+    def __init__(self, batch_size, pred=None):
+        self.batch_size = batch_size
+        # pred([(data, start, end), ...]) -> 每个节点的结果
+        self.pred = pred
+        self.segments = deque()
+        self.size = 0
+
+    def add(self, owner, data, num):
+        if num:
+            self.segments.append([owner, data, 0, num])
+            self.size += num
+
+    def take(self):
+        """
+        取出最多 batch_size 个节点，返回 [(owner, data, start, end), ...]
+        """
+        batch, count = [], 0
+        while self.segments and count < self.batch_size:
+            segment = self.segments[0]
+            owner, data, start, end = segment
+            stop = min(end, start + self.batch_size - count)
+            batch.append((owner, data, start, stop))
+            count += stop - start
+            if stop == end:
+                self.segments.popleft()
+            else:
+                segment[2] = stop
+        self.size -= count
+        return batch
+
+    def discard(self, owner):
+        kept = deque()
+        for segment in self.segments:
+            if segment[0] is owner:
+                self.size -= segment[3] - segment[2]
+            else:
+                kept.append(segment)
+        self.segments = kept
+
+    def flush(self, force=False):
+        """
+        依次产出 (owner, start, results)
+        """
+        while self.size >= self.batch_size or (force and self.size):
+            batch = self.take()
+            results = self.pred([(data, start, stop) for _, data, start, stop in batch])
+            offset = 0
+            for owner, _, start, stop in batch:
+                yield owner, start, results[offset : offset + stop - start]
+                offset += stop - start
+
+
+class Request:
+    def __init__(self, num):
+        self.results = [None] * num
+        self.remaining = num
+        self.submitted_at = time.perf_counter()
+        self.started = False
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceScheduler:
+    """
+    把并发请求的节点放进同一个队列，凑够 batch_size 个节点或最早的请求
+    等待超过 max_wait 秒时跑一次模型，再把结果分发回各个请求
+    group 不同的节点不会放在同一批（如截图缩放后尺寸不同）
+    """
+
+    def __init__(self, pred, batch_size=256, max_wait=0.02):
+        # pred([(data, start, end), ...]) -> 每个节点的结果
+        self.pred = pred
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queues = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+        self.pending_requests = 0
+        self.requests = 0
+        self.batches = 0
+        self.batch_nodes = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def start(self):
+        # fork 出的子进程里原来的线程已不存在，需要重新启动
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self.run, name="inference-scheduler", daemon=True
+            )
+            self.thread.start()
+
+    def submit(self, data, num, group=None):
+        """
+        加入 data 的 num 个节点，阻塞直到全部算完，返回每个节点的结果
+        """
+        return self.wait(self.submit_async(data, num, group))
+
+    def submit_async(self, data, num, group=None):
+        """
+        加入 data 的 num 个节点后立即返回，用 wait 取结果
+        同一 group 中先加入的节点先算
+        """
+        request = Request(num)
+        if num == 0:
+            request.done.set()
+            return request
+
+        with self.condition:
+            self.start()
+            if group not in self.queues:
+                self.queues[group] = NodeQueue(self.batch_size)
+            self.queues[group].add(request, data, num)
+            self.pending_requests += 1
+            self.requests += 1
+            self.condition.notify()
+        return request
+
+    def wait(self, request):
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def next_queue(self):
+        """
+        等到某个队列凑满一批，或最早的请求已等满 max_wait，返回该队列
+        """
+        while True:
+            oldest, oldest_queue = None, None
+            for queue in self.queues.values():
+                if queue.size >= self.batch_size:
+                    return queue
+                if queue.size:
+                    submitted_at = queue.segments[0][0].submitted_at
+                    if oldest is None or submitted_at < oldest:
+                        oldest, oldest_queue = submitted_at, queue
+
+            if oldest_queue is None:
+                self.condition.wait()
+                continue
+            remaining = oldest + self.max_wait - time.perf_counter()
+            if remaining <= 0:
+                return oldest_queue
+            self.condition.wait(remaining)
+
+    def run(self):
+        while True:
+            with self.condition:
+                batch = self.next_queue().take()
+                now = time.perf_counter()
+                self.batches += 1
+                self.batch_nodes += sum(stop - start for _, _, start, stop in batch)
+                for request, _, _, _ in batch:
+                    if not request.started:
+                        request.started = True
+                        wait = now - request.submitted_at
+                        self.wait_seconds += wait
+                        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+            try:
+                results = self.pred(
+                    [(data, start, stop) for _, data, start, stop in batch]
+                )
+                error = None
+            except Exception as e:
+                results, error = None, e
+
+            offset = 0
+            for request, _, start, stop in batch:
+                # 已结束的请求也要跳过它在本批中的结果
+                chunk = slice(offset, offset + stop - start)
+                offset += stop - start
+                if request.done.is_set():
+                    continue
+                if error is not None:
+                    request.error = error
+                    self.discard(request)
+                    self.finish(request)
+                    continue
+
+                request.results[start:stop] = results[chunk]
+                request.remaining -= stop - start
+                if request.remaining == 0:
+                    self.finish(request)
+
+    def discard(self, request):
+        """
+        出错的请求不再计算，从队列中去掉它剩下的节点
+        """
+        with self.condition:
+            for queue in self.queues.values():
+                queue.discard(request)
+
+    def finish(self, request):
+        with self.condition:
+            self.pending_requests -= 1
+        request.done.set()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queue_nodes": sum(queue.size for queue in self.queues.values()),
+                "queue_requests": self.pending_requests,
+                "requests": self.requests,
+                "batches": self.batches,
+                "batch_size": self.batch_size,
+                "batch_fill_ratio": (
+                    round(self.batch_nodes / (self.batches * self.batch_size), 4)
+                    if self.batches
+                    else None
+                ),
+                "avg_wait_ms": (
+                    round(self.wait_seconds / self.requests * 1000, 3)
+                    if self.requests
+                    else None
+                ),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            }
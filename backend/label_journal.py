@@ -0,0 +1,255 @@
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # 没有 fcntl 的平台上不能多进程服务，只在进程内加锁
+    fcntl = None
+
+# always: 每次写入日志后 fsync；interval: 后台合并时 fsync 标注文件和日志；
+# never: 不 fsync，交给操作系统
+fsync_policies = ["always", "interval", "never"]
+
+
+class LabelJournal:
+    """
+    一个 batch 的标注写入日志 labelled/<name>.log，每行一条 json：
+        {"page_id": 1, "set": [...]} 或 {"page_id": 1, "add": [...], "remove": [...]}
+    请求中只追加日志并更新内存中的结果，后台线程定期把有变化的页面写成
+    labelled/<page_id>.json（先写临时文件再替换），之后换成空日志
+    启动时先重放上次未合并的日志，标注文件的格式不变
+    多进程服务时所有 worker 共用同一个日志，读写前用 labelled/journal.lock 上的
+    文件锁串行化，并先重放其他 worker 追加的记录，增删节点不会基于过期的标注
+    """
+
+    def __init__(
+        self, labelled_dir, name="journal", fsync="interval", compact_interval=1.0
+    ):
+        if fsync not in fsync_policies:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.labelled_dir = labelled_dir
+        self.journal_file = os.path.join(labelled_dir, f"{name}.log")
+        self.fsync = fsync
+        self.compact_interval = compact_interval
+        # 同一进程的线程之间用 lock，进程之间用 lock_file 上的 flock
+        self.lock = threading.Lock()
+        self.lock_file = open(os.path.join(labelled_dir, "journal.lock"), "a")
+        # page_id -> 标注的节点 id 集合，日志中尚未写入标注文件的页面
+        self.pending = {}
+        self.dirty = threading.Event()
+
+        self.appends = 0
+        self.compactions = 0
+        self.files_written = 0
+
+        # 当前日志文件的追加句柄和已重放到的位置
+        self.journal = None
+        self.offset = 0
+        with self.lock, self.file_lock(exclusive=True):
+            self.sync(truncate=True)
+        self.thread = None
+        # 上次退出前没有合并的记录立即写成标注文件，
+        # 列表和导出只看标注文件，不等下一次写入
+        if self.pending:
+            self.compact()
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self.run, name="label-journal", daemon=True
+            )
+            self.thread.start()
+
+    @contextlib.contextmanager
+    def file_lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def label_file(self, page_id):
+        return os.path.join(self.labelled_dir, f"{page_id}.json")
+
+    def read_file(self, page_id):
+        try:
+            with open(self.label_file(page_id), "r", encoding="utf-8") as f:
+                return set(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def current(self, page_id):
+        labels = self.pending.get(page_id)
+        if labels is not None:
+            return labels
+        return self.read_file(page_id)
+
+    def apply_entry(self, entry):
+        """
+        返回修改后的标注集合
+        """
+        page_id = entry["page_id"]
+        if "set" in entry:
+            labels = set(entry["set"])
+        else:
+            labels = set(self.current(page_id) or ())
+            labels.update(entry.get("add", ()))
+            labels.difference_update(entry.get("remove", ()))
+        self.pending[page_id] = labels
+        return labels
+
+    def sync(self, truncate=False):
+        """
+        重放日志中其他进程追加的记录，需要持有 lock 和文件锁
+        日志被其他进程合并后换成了新文件，此前的记录都已写入标注文件
+        truncate: 持有排他锁时截掉进程退出时写了一半的最后一行
+        """
+        try:
+            inode = os.stat(self.journal_file).st_ino
+        except FileNotFoundError:
+            inode = None
+        # 一直打开着旧日志，它的 inode 不会被新文件复用
+        if self.journal is None or inode != os.fstat(self.journal.fileno()).st_ino:
+            if inode is None and not truncate:
+                # 只持有共享锁时不创建日志，等下一次写入
+                self.pending.clear()
+                return
+            if self.journal is not None:
+                self.journal.close()
+            self.journal = open(self.journal_file, "ab")
+            self.pending.clear()
+            self.offset = 0
+
+        start = self.offset
+        with open(self.journal_file, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            self.apply_entry(entry)
+            self.offset += len(line)
+        if truncate and len(data) > self.offset - start:
+            self.journal.truncate(self.offset)
+
+    def get(self, page_id):
+        """
+        当前的标注，没有标注时返回 None
+        """
+        with self.lock, self.file_lock(exclusive=False):
+            self.sync()
+            labels = self.current(page_id)
+        return None if labels is None else sorted(labels)
+
+    def write(self, page_id, labels=None, add=(), remove=()):
+        """
+        labels 不为 None 时整体替换，否则在原标注上增删节点，返回新的标注
+        """
+        if labels is not None:
+            entry = {"page_id": page_id, "set": list(labels)}
+        else:
+            entry = {"page_id": page_id, "add": list(add), "remove": list(remove)}
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+
+        with self.lock, self.file_lock(exclusive=True):
+            self.sync(truncate=True)
+            self.journal.write(line)
+            self.journal.flush()
+            if self.fsync == "always":
+                os.fsync(self.journal.fileno())
+            self.offset += len(line)
+            labels = self.apply_entry(entry)
+            self.appends += 1
+            self.start()
+        self.dirty.set()
+        return sorted(labels)
+
+    def write_file(self, page_id, labels):
+        output = self.label_file(page_id)
+        # 临时文件名不带 .json，不会被当作标注文件
+        tmp_file = os.path.join(self.labelled_dir, f".{page_id}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(sorted(labels), f)
+            if self.fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, output)
+
+    def compact(self, force=False):
+        """
+        把日志中的页面写成标注文件，再换成空日志
+        """
+        with self.lock, self.file_lock(exclusive=True):
+            self.sync(truncate=True)
+            if not self.pending and not force:
+                return
+            for page_id, labels in self.pending.items():
+                self.write_file(page_id, labels)
+
+            # 换成新文件而不是原地截断，其他进程据此知道日志已经合并
+            tmp_file = f"{self.journal_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                if self.fsync != "never":
+                    os.fsync(f.fileno())
+            os.replace(tmp_file, self.journal_file)
+            self.journal.close()
+            self.journal = open(self.journal_file, "ab")
+            self.offset = 0
+            self.compactions += 1
+            self.files_written += len(self.pending)
+            self.pending.clear()
+
+    def close(self):
+        """
+        合并所有修改后关闭日志
+        """
+        self.compact()
+        with self.lock:
+            self.journal.close()
+            self.journal = None
+            self.lock_file.close()
+
+    def run(self):
+        while True:
+            self.dirty.wait()
+            # 攒一段时间的修改再合并，连续点选同一页只写一次文件
+            time.sleep(self.compact_interval)
+            self.dirty.clear()
+            try:
+                self.compact()
+            except OSError:
+                # 磁盘错误时保留日志，下次再试
+                self.dirty.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending_pages": len(self.pending),
+                "appends": self.appends,
+                "compactions": self.compactions,
+                "files_written": self.files_written,
+            }
+
+
+def recover(labelled_dir):
+    """
+    合并目录下所有日志，包括旧版本每个 worker 各自写的 journal.<worker>.log
+    只能在没有其他进程写入标注时调用，如多进程服务 fork 之前
+    """
+    for journal_file in glob.glob(os.path.join(labelled_dir, "journal*.log")):
+        name = os.path.basename(journal_file)[: -len(".log")]
+        LabelJournal(labelled_dir, name).close()
+        if name != "journal":
+            os.remove(journal_file)
@@ -0,0 +1,118 @@
+"""
+进程内的耗时直方图，按 Prometheus 文本格式输出，用法：
+
+    with metrics.timer("image_decode"):
+        ...
+    metrics.observe("a11y_request_seconds", seconds, route="/get/list")
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+descriptions = {
+    "a11y_request_seconds": "Request latency by route",
+    "a11y_stage_seconds": "Latency of each processing stage",
+}
+histograms = {}
+histograms_lock = threading.Lock()
+# name -> (返回 {字段: 数值} 的函数, 计数器字段)，计数器输出为 name_字段_total 的
+# counter，其他字段输出为 name_字段 的 gauge
+collectors = {}
+
+
+class Histogram:
+    def __init__(self):
+        # 每个桶单独计数，输出时再累加
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    histogram = histograms.get(key)
+    if histogram is None:
+        with histograms_lock:
+            histogram = histograms.setdefault(key, Histogram())
+    histogram.observe(seconds)
+
+
+def register(name, collect, counters=()):
+    """
+    counters: 只增不减的字段，如命中次数，Prometheus 的 rate() 只对 counter 正确
+    """
+    collectors[name] = (collect, frozenset(counters))
+
+
+@contextmanager
+def timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("a11y_stage_seconds", time.perf_counter() - start, stage=stage)
+
+
+def format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    escaped = [
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render():
+    """
+    Prometheus 文本格式
+    """
+    with histograms_lock:
+        items = sorted(histograms.items())
+
+    lines, last_name = [], None
+    for (name, labels), histogram in items:
+        if name != last_name:
+            lines.append(f"# HELP {name} {descriptions.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            last_name = name
+
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(
+                f"{name}_bucket{format_labels(labels, [('le', str(bound))])} "
+                f"{cumulative}"
+            )
+        lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+    for name, (collect, counters) in sorted(collectors.items()):
+        for field, value in collect().items():
+            if not isinstance(value, (int, float)):
+                continue
+            if field in counters:
+                lines.append(f"# TYPE {name}_{field}_total counter")
+                lines.append(f"{name}_{field}_total {value}")
+            else:
+                lines.append(f"# TYPE {name}_{field} gauge")
+                lines.append(f"{name}_{field} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,94 @@
+import importlib
+import threading
+import time
+
+
+class ModelLoader:
+    """
+    按需导入分类器模块并加载模型，记录加载状态和耗时
+    """
+
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.module = None
+        # not_loaded / loading / ready / failed
+        self.state = "not_loaded"
+        self.load_seconds = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        返回模型已加载好的分类器模块，第一次调用时阻塞直到加载完成
+        """
+        if self.state == "ready":
+            return self.module
+
+        with self.lock:
+            if self.state != "ready":
+                self.state = "loading"
+                self.error = None
+                start = time.perf_counter()
+                try:
+                    module = importlib.import_module(self.module_name)
+                    module.get_model()
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = repr(e)
+                    raise
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                self.module = module
+                self.state = "ready"
+        return self.module
+
+    def status(self):
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+loaders = {
+    "v1": ModelLoader("online_focus_classifier"),
+    "v2": ModelLoader("a11y_mlp_classifier"),
+}
+
+
+def get(name):
+    return loaders[name].get()
+
+
+def model_version(name):
+    """
+    只导入模块、不加载模型，返回当前模型版本标识
+    """
+    return importlib.import_module(loaders[name].module_name).model_version()
+
+
+def status():
+    return {name: loader.status() for name, loader in loaders.items()}
+
+
+def is_ready(names=None):
+    return all(loaders[name].state == "ready" for name in names or loaders)
+
+
+def warm_up(names=None, before=None):
+    """
+    在后台线程中依次加载模型，before 为加载模型前先执行的函数（如扫描页面）
+    """
+
+    def run():
+        if before is not None:
+            before()
+        for name in names or loaders:
+            try:
+                loaders[name].get()
+            except Exception:
+                # 失败状态已记录，请求到来时会再次尝试加载
+                pass
+
+    thread = threading.Thread(target=run, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,163 @@
+"""
+按列存储一页的节点：坐标、布尔属性、id 和文本字段各为一个数组，
+有效性判断、坐标换算等都在整列上计算，不再逐个节点循环
+"""
+
+from operator import itemgetter
+
+import numpy as np
+import prelabel
+
+# 顺序与 a11y_mlp_classifier 的属性向量一致，text、content_description 表示是否非空
+flag_fields = [
+    "focusable",
+    "checkable",
+    "checked",
+    "focused",
+    "selected",
+    "clickable",
+    "long_clickable",
+    "context_clickable",
+    "enabled",
+    "text",
+    "content_description",
+]
+text_fields = ["class_name", "view_id_resource_name", "content_description", "text"]
+flag_index = {field: i for i, field in enumerate(flag_fields)}
+bounds_getter = itemgetter("screen_left", "screen_right", "screen_top", "screen_bottom")
+
+
+class PageNodes:
+    """
+    ids: object 数组；bounds: float64 [N, 4]，(left, right, top, bottom) 屏幕坐标；
+    flags: bool [N, len(flag_fields)]；texts: {字段: object 数组}，原始字符串或 None
+    """
+
+    def __init__(self, ids, bounds, flags, texts):
+        self.ids = ids
+        self.bounds = bounds
+        self.flags = flags
+        self.texts = texts
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        """
+        nodes: 页面 json 中的 nodes 列表
+        """
+        ids = np.empty(len(nodes), dtype=object)
+        ids[:] = [node["id"] for node in nodes]
+        bounds = np.array(list(map(bounds_getter, nodes)), dtype=np.float64).reshape(
+            -1, 4
+        )
+        # object 数组转 bool 按真值判断，None、空字符串为 False
+        flags = np.zeros((len(nodes), len(flag_fields)), dtype=bool)
+        for i, field in enumerate(flag_fields):
+            flags[:, i] = np.array(
+                [node.get(field) for node in nodes], dtype=object
+            ).astype(bool)
+        texts = {}
+        for field in text_fields:
+            texts[field] = np.empty(len(nodes), dtype=object)
+            texts[field][:] = [node.get(field) for node in nodes]
+        return cls(ids, bounds, flags, texts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subset(self, mask):
+        """
+        mask: bool 数组或下标数组
+        """
+        return PageNodes(
+            self.ids[mask],
+            self.bounds[mask],
+            self.flags[mask],
+            {field: values[mask] for field, values in self.texts.items()},
+        )
+
+    def flag(self, field):
+        return self.flags[:, flag_index[field]]
+
+    def clamped_bounds(self, page_id):
+        """
+        底部去掉导航栏、右侧不超过屏幕宽度
+        """
+        phone_width, phone_height, extra_bottom = prelabel.screen_size(page_id)
+        bounds = self.bounds.copy()
+        np.minimum(bounds[:, 1], phone_width, out=bounds[:, 1])
+        np.minimum(bounds[:, 3], phone_height - extra_bottom, out=bounds[:, 3])
+        return bounds
+
+    def valid(self, page_id):
+        """
+        坐标有效的节点，bool 数组
+        """
+        _, phone_height, extra_bottom = prelabel.screen_size(page_id)
+        bounds = self.clamped_bounds(page_id)
+        left, right, top, bottom = bounds.T
+        return (
+            (bounds >= 0).all(axis=1)
+            & (top < phone_height - extra_bottom)
+            & (left < right)
+            & (top < bottom)
+        )
+
+    def interactive(self):
+        """
+        可点击、可聚焦或带文本/描述的节点，bool 数组
+        """
+        return (
+            self.flag("clickable")
+            | self.flag("focusable")
+            | self.flag("text")
+            | self.flag("content_description")
+        )
+
+    def priority(self):
+        """
+        按最可能可交互排序的下标数组：可点击/可聚焦的在前，其次带文本/描述的，
+        同一级保持原顺序；流式预标注按此顺序先算
+        """
+        score = 2 * (
+            self.flag("clickable")
+            | self.flag("focusable")
+            | self.flag("long_clickable")
+        ) + (self.flag("text") | self.flag("content_description"))
+        return np.argsort(-score.astype(np.int8), kind="stable")
+
+    def algo_coordinators(self, page_id, image_size):
+        """
+        截图上的像素坐标 int64 [N, 4]，(left, right, top, bottom)
+        """
+        phone_width, phone_height, _ = prelabel.screen_size(page_id)
+        w, h = image_size
+        ratios = np.array(
+            [w / phone_width, w / phone_width, h / phone_height, h / phone_height]
+        )
+        # 与 int() 一致，向零取整
+        return np.trunc(self.clamped_bounds(page_id) * ratios).astype(np.int64)
+
+    def normal_coordinators(self, page_id):
+        """
+        按屏幕尺寸归一化的坐标 float64 [N, 4]
+        """
+        phone_width, phone_height, _ = prelabel.screen_size(page_id)
+        return self.clamped_bounds(page_id) / np.array(
+            [phone_width, phone_width, phone_height, phone_height], dtype=np.float64
+        )
+
+    def attributes(self, page_id):
+        """
+        布尔属性和归一化坐标拼成的 float32 [N, len(flag_fields) + 4]
+        """
+        return np.concatenate(
+            (self.flags.astype(np.float32), self.normal_coordinators(page_id)), axis=1
+        ).astype(np.float32)
+
+
+def valid_page_nodes(page_id, nodes):
+    """
+    nodes: 页面 json 中的 nodes，返回只包含有效节点的 PageNodes
+    """
+    page_nodes = PageNodes.from_nodes(nodes)
+    return page_nodes.subset(page_nodes.valid(page_id))
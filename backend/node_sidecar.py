@@ -0,0 +1,226 @@
+"""
+页面节点的二进制副本 <page_id>.nodes.bin，放在 <page_id>.json 旁边，
+只包含后端用到的 id、坐标、布尔属性和文本字段，按列存储，读取时直接 mmap
+json 的大小或 mtime 变化后读取时会自动重建，批量转换已有数据：
+
+    python node_sidecar.py batch0 batch1
+
+文件格式：magic (8 字节) + header 长度 (uint32) + json header，
+之后是 8 字节对齐的各列数据，header 中记录每列的 offset、dtype 和 shape
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import metrics
+import node_geometry
+import numpy as np
+import prelabel
+
+magic = b"A11YNOD1"
+version = 1
+static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def sidecar_file(json_file):
+    return f"{os.path.splitext(json_file)[0]}.nodes.bin"
+
+
+def source_identity(json_file):
+    stat = os.stat(json_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def encode(page_nodes, identity):
+    """
+    返回文件内容，id 不是整数或文本字段不是字符串时返回 None（不生成副本）
+    """
+    ids = page_nodes.ids.tolist()
+    if not all(type(node_id) is int for node_id in ids):
+        return None
+
+    # 文本字段去重后存成字符串表，列中存下标，None 为 -1
+    strings, string_index = [], {}
+    text_columns = np.full((len(ids), len(node_geometry.text_fields)), -1, np.int32)
+    for i, field in enumerate(node_geometry.text_fields):
+        for j, value in enumerate(page_nodes.texts[field]):
+            if value is None:
+                continue
+            if type(value) is not str:
+                return None
+            if value not in string_index:
+                string_index[value] = len(strings)
+                strings.append(value)
+            text_columns[j, i] = string_index[value]
+    encoded = [s.encode("utf-8") for s in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    string_offsets[1:] = np.cumsum([len(s) for s in encoded])
+
+    columns = {
+        "ids": np.array(ids, dtype=np.int64),
+        "bounds": page_nodes.bounds.astype(np.float64),
+        "flags": page_nodes.flags.astype(np.uint8),
+        "texts": text_columns,
+        "string_offsets": string_offsets,
+        "string_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+    }
+    sections, offset = {}, 0
+    for name, column in columns.items():
+        sections[name] = [offset, column.dtype.str, list(column.shape)]
+        offset += (column.nbytes + 7) // 8 * 8
+
+    header = json.dumps(
+        {
+            "version": version,
+            "source": list(identity),
+            "count": len(ids),
+            "flag_fields": node_geometry.flag_fields,
+            "text_fields": node_geometry.text_fields,
+            "sections": sections,
+        }
+    ).encode("utf-8")
+    header += b" " * (-(len(magic) + 4 + len(header)) % 8)
+
+    chunks = [magic, struct.pack("<I", len(header)), header]
+    for column in columns.values():
+        data = column.tobytes()
+        chunks.append(data + b"\0" * (-len(data) % 8))
+    return b"".join(chunks)
+
+
+def write(json_file, page_nodes=None):
+    """
+    由 json 生成副本，返回 PageNodes
+    """
+    identity = source_identity(json_file)
+    if page_nodes is None:
+        page_nodes = node_geometry.PageNodes.from_nodes(prelabel.load_nodes(json_file))
+    data = encode(page_nodes, identity)
+    if data is None:
+        return page_nodes
+
+    output = sidecar_file(json_file)
+    tmp_file = f"{output}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+    os.replace(tmp_file, output)
+    return page_nodes
+
+
+def read(json_file):
+    """
+    读取副本，不存在、格式不对或 json 已变化时返回 None
+    """
+    try:
+        identity = source_identity(json_file)
+        with open(sidecar_file(json_file), "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if buffer[: len(magic)] != magic:
+        return None
+    try:
+        (header_len,) = struct.unpack_from("<I", buffer, len(magic))
+        start = len(magic) + 4
+        header = json.loads(bytes(buffer[start : start + header_len]))
+    except (struct.error, ValueError):
+        return None
+    if (
+        header["version"] != version
+        or tuple(header["source"]) != identity
+        or header["flag_fields"] != node_geometry.flag_fields
+        or header["text_fields"] != node_geometry.text_fields
+    ):
+        return None
+
+    data_start = start + header_len
+    columns = {}
+    for name, (offset, dtype, shape) in header["sections"].items():
+        columns[name] = np.frombuffer(
+            buffer,
+            dtype=np.dtype(dtype),
+            count=int(np.prod(shape)),
+            offset=data_start + offset,
+        ).reshape(shape)
+
+    string_data = columns["string_data"].tobytes()
+    string_offsets = columns["string_offsets"]
+    # 最后一个位置放 None，对应下标 -1
+    strings = np.empty(len(string_offsets), dtype=object)
+    strings[:-1] = [
+        string_data[string_offsets[i] : string_offsets[i + 1]].decode("utf-8")
+        for i in range(len(string_offsets) - 1)
+    ]
+    strings[-1] = None
+
+    ids = np.empty(header["count"], dtype=object)
+    ids[:] = columns["ids"].tolist()
+    return node_geometry.PageNodes(
+        ids,
+        columns["bounds"],
+        columns["flags"].astype(bool),
+        {
+            field: strings[columns["texts"][:, i]]
+            for i, field in enumerate(node_geometry.text_fields)
+        },
+    )
+
+
+def load_page_nodes(json_file):
+    """
+    优先读取二进制副本，没有或已过期时解析 json 并重建副本
+    """
+    with metrics.timer("sidecar_read"):
+        page_nodes = read(json_file)
+    if page_nodes is not None:
+        return page_nodes
+
+    page_nodes = node_geometry.PageNodes.from_nodes(prelabel.load_nodes(json_file))
+    try:
+        write(json_file, page_nodes)
+    except OSError:
+        # 目录只读等情况下直接使用 json 的结果
+        pass
+    return page_nodes
+
+
+def convert_batch(batch, force=False):
+    dataset_dir = os.path.join(static_dir, batch)
+    written = skipped = failed = 0
+    start = time.perf_counter()
+    for page_id in prelabel.batch_page_ids(dataset_dir):
+        json_file = os.path.join(dataset_dir, f"{page_id}.json")
+        if not force and read(json_file) is not None:
+            skipped += 1
+            continue
+        try:
+            write(json_file)
+            written += 1
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  page {page_id} failed: {e!r}")
+            failed += 1
+    print(
+        f"{batch}: {written} written, {skipped} up to date, {failed} failed "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("batches", nargs="+")
+    # 忽略已有副本，全部重新生成
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    for batch in args.batches:
+        convert_batch(batch, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
+import os
+import threading
+
+import metrics
+import numpy as np
 import torch
 import torch.nn as nn
 import torchvision
@@ -5,46 +10,152 @@ import torchvision.transforms.functional as F
 from torchvision import transforms
 
 weight_path = "./image_classifier_focus.pth"
+# eager: 用 weight_path 构建模型；torchscript: 加载 export_engine.py 导出的 engine_file
+backend = "eager"
+engine_file = "./image_classifier_focus.torchscript.pt"
 class_num = 2
-model = torchvision.models.resnet50()
-model.fc = nn.Linear(model.fc.in_features, class_num)
-if torch.cuda.is_available():
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+batch_size = 32
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+model = None
+model_lock = threading.Lock()
+
+
+class SampleBatchNorm2d(nn.Module):
+    """
+    逐样本统计量的 BN，等价于训练模式下 batch size 为 1 的 BatchNorm2d
+    """
+
+    def __init__(self, bn):
+        super().__init__()
+        self.weight = bn.weight
+        self.bias = bn.bias
+        self.eps = bn.eps
+
+    def forward(self, x):
+        return nn.functional.instance_norm(
+            x, weight=self.weight, bias=self.bias, eps=self.eps
+        )
+
+
+def use_sample_batch_norm(module):
+    for name, child in module.named_children():
+        if isinstance(child, nn.BatchNorm2d):
+            setattr(module, name, SampleBatchNorm2d(child))
+        else:
+            use_sample_batch_norm(child)
+
+
+def load_model():
+    if backend == "torchscript":
+        model = torch.jit.load(engine_file, map_location=device)
+        model.eval()
+        return model
+
+    model = torchvision.models.resnet50()
+    model.fc = nn.Linear(model.fc.in_features, class_num)
     model.load_state_dict(torch.load(weight_path, map_location=device))
-else:
-    device = torch.device("cpu")
-    model.load_state_dict(torch.load(weight_path, map_location=torch.device("cpu")))
-model = model.to(device)
 
+    # 模型一直以训练模式逐张推理，BN 用的是单张图片自身的统计量；
+    # 批量推理时改为逐样本归一化，保证结果与逐张推理一致
+    use_sample_batch_norm(model)
+    model = model.to(device)
+    model.eval()
+    return model
 
-def pred_model(image, coordinator=None):
+
+def model_version():
     """
-    传入图片路径,模型预测,正样本返回True,负样本返回False
-    coordinator: (left, right, top, bottom)
+    模型文件的标识，权重或导出的模型更新后随之变化
+    """
+    if backend == "torchscript":
+        stat = os.stat(engine_file)
+        return (
+            f"torchscript:{os.path.abspath(engine_file)}:"
+            f"{stat.st_size}:{stat.st_mtime_ns}"
+        )
+    stat = os.stat(weight_path)
+    return f"{os.path.abspath(weight_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def get_model():
+    """
+    第一次调用时加载模型，之后直接返回
     """
-    transform_array = [
+    global model
+    if model is None:
+        with model_lock:
+            if model is None:
+                model = load_model()
+    return model
+
+
+crop_transform = transforms.Compose(
+    [
         transforms.Resize(256),
         transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
     ]
-    if coordinator:
-        left, right, top, bottom = coordinator
-        transform_array.insert(
-            0,
-            transforms.Lambda(
-                lambda img: F.crop(img, top, left, bottom - top, right - left)
-            ),
+)
+mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+def crop_image(image, coordinator):
+    if not coordinator:
+        return image
+    left, right, top, bottom = coordinator
+    return F.crop(image, top, left, bottom - top, right - left)
+
+
+def prepare_crops(image, coordinators):
+    """
+    裁剪并缩放各区域，返回 uint8 数组 [N, 224, 224, 3]
+    不依赖模型，可以放在其他进程中执行
+    """
+    if not coordinators:
+        return np.zeros((0, 224, 224, 3), dtype=np.uint8)
+    with metrics.timer("v1_crop"):
+        return np.stack(
+            [np.asarray(crop_transform(crop_image(image, c))) for c in coordinators]
         )
 
-    # 打开图像并进行预处理
-    transform = transforms.Compose(transform_array)
-    image_tensor = transform(image).unsqueeze(0)
-    image_tensor = image_tensor.to(device)
-
-    # 进行预测
-    with torch.no_grad():
-        outputs = model(image_tensor)
-        _, predicted = torch.max(outputs.data.abs(), 1)
-        delt = outputs.data.abs()[0][1] - outputs.data.abs()[0][0]
-        return not (delt < -0.0173 and delt > -0.018)
+
+def crops_to_tensor(crops):
+    """
+    等价于逐张 ToTensor + Normalize
+    """
+    tensor = torch.from_numpy(crops).permute(0, 3, 1, 2).float().div(255)
+    return tensor.sub_(mean).div_(std)
+
+
+def is_focus(output):
+    output = output.abs()
+    delt = output[1] - output[0]
+    return not (delt < -0.0173 and delt > -0.018)
+
+
+def pred_crops(crops):
+    """
+    crops: prepare_crops 的结果，一次前向，返回 True/False 列表
+    """
+    with torch.no_grad(), metrics.timer("v1_model"):
+        outputs = get_model()(crops_to_tensor(crops).to(device)).cpu()
+    return [is_focus(output) for output in outputs]
+
+
+def pred_model(image, coordinator=None):
+    """
+    传入图片路径,模型预测,正样本返回True,负样本返回False
+    coordinator: (left, right, top, bottom)
+    """
+    return pred_model_batch(image, [coordinator])[0]
+
+
+def pred_model_batch(image, coordinators, batch_size=batch_size):
+    """
+    对同一张截图上的多个区域批量预测，按 coordinators 顺序返回 True/False 列表
+    coordinators: [(left, right, top, bottom), ...]
+    """
+    preds = []
+    for i in range(0, len(coordinators), batch_size):
+        preds.extend(pred_crops(prepare_crops(image, coordinators[i : i + batch_size])))
+    return preds
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+class PageIndex:
+    """
+    每个 batch 一个 sqlite 索引，记录页面的总节点数、有效节点数、已标注节点数
+    以页面 json 和标注文件的 mtime 判断是否失效，失效时才重新读文件计数
+    """
+
+    def __init__(self, dataset_dir, count_nodes, count_labelled_nodes):
+        self.dataset_dir = dataset_dir
+        # count_nodes(page_id) -> (total_num, valid_num)
+        self.count_nodes = count_nodes
+        # count_labelled_nodes(page_id) -> labelled_num
+        self.count_labelled_nodes = count_labelled_nodes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            os.path.join(dataset_dir, "page_index.db"), check_same_thread=False
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS page ("
+            "page_id INTEGER PRIMARY KEY, page_mtime INTEGER, "
+            "total_num INTEGER, valid_num INTEGER, "
+            "labelled_mtime INTEGER, labelled_num INTEGER)"
+        )
+        self.db.commit()
+
+    def page_file(self, page_id):
+        return os.path.join(self.dataset_dir, f"{page_id}.json")
+
+    def labelled_file(self, page_id):
+        return os.path.join(self.dataset_dir, "labelled", f"{page_id}.json")
+
+    def get_counts(self, page_ids):
+        """
+        返回 {page_id: (total_num, valid_num, labelled_num)}
+        """
+        with self.lock:
+            rows = {}
+            for i in range(0, len(page_ids), 500):
+                chunk = page_ids[i : i + 500]
+                for row in self.db.execute(
+                    "SELECT * FROM page WHERE page_id IN (%s)"
+                    % ",".join("?" * len(chunk)),
+                    chunk,
+                ):
+                    rows[row[0]] = row
+
+            counts, updates = {}, []
+            for page_id in page_ids:
+                page_mtime = file_mtime(self.page_file(page_id))
+                labelled_mtime = file_mtime(self.labelled_file(page_id))
+                row = rows.get(page_id)
+
+                if row is None or row[1] != page_mtime:
+                    total_num, valid_num = self.count_nodes(page_id)
+                else:
+                    total_num, valid_num = row[2], row[3]
+
+                if row is None or row[4] != labelled_mtime:
+                    labelled_num = self.count_labelled_nodes(page_id)
+                else:
+                    labelled_num = row[5]
+
+                new_row = (
+                    page_id,
+                    page_mtime,
+                    total_num,
+                    valid_num,
+                    labelled_mtime,
+                    labelled_num,
+                )
+                if new_row != row:
+                    updates.append(new_row)
+                counts[page_id] = (total_num, valid_num, labelled_num)
+
+            if updates:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO page VALUES (?, ?, ?, ?, ?, ?)", updates
+                )
+                self.db.commit()
+        return counts
+
+    def set_labelled_num(self, page_id, labelled_num):
+        """
+        保存标注后原地更新该页的已标注节点数，不需要重新读标注文件
+        """
+        labelled_mtime = file_mtime(self.labelled_file(page_id))
+        with self.lock:
+            # 索引里还没有这一页时，留到下次列表请求时再计数
+            self.db.execute(
+                "UPDATE page SET labelled_mtime = ?, labelled_num = ? WHERE page_id = ?",
+                (labelled_mtime, labelled_num, page_id),
+            )
+            self.db.commit()
@@ -0,0 +1,120 @@
+import bisect
+import os
+import threading
+
+# /get/list 的 filter
+ALL = -1
+NOT_LABELLED = 0
+LABELLED = 1
+
+
+class PageRegistry:
+    """
+    一个 batch 的页面列表，全部、未标注、已标注三个列表始终保持有序，
+    标注状态变化时在两个列表之间移动，分页只切出需要的部分
+    所有读写都在锁内，可以在 Flask 的多个线程中使用
+    """
+
+    def __init__(self, page_ids, labelled_page_ids):
+        self.members = set(page_ids)
+        self.labelled = self.members & set(labelled_page_ids)
+        self.page_ids = sorted(self.members)
+        self.lists = {
+            ALL: self.page_ids,
+            NOT_LABELLED: [i for i in self.page_ids if i not in self.labelled],
+            LABELLED: [i for i in self.page_ids if i in self.labelled],
+        }
+        self.lock = threading.Lock()
+        # 上次 refresh 时标注目录的 mtime
+        self.labelled_mtime = None
+
+    def __contains__(self, page_id):
+        return page_id in self.members
+
+    def __len__(self):
+        return len(self.page_ids)
+
+    def add(self, page_id, labelled=False):
+        """
+        加入扫描之后新增的页面，已存在时返回 False
+        """
+        with self.lock:
+            if page_id in self.members:
+                return False
+            self.members.add(page_id)
+            bisect.insort(self.page_ids, page_id)
+            if labelled:
+                self.labelled.add(page_id)
+                bisect.insort(self.lists[LABELLED], page_id)
+            else:
+                bisect.insort(self.lists[NOT_LABELLED], page_id)
+            return True
+
+    def mark_labelled(self, page_id):
+        """
+        未标注的页面移到已标注，状态有变化时返回 True
+        """
+        with self.lock:
+            if page_id not in self.members or page_id in self.labelled:
+                return False
+            not_labelled = self.lists[NOT_LABELLED]
+            del not_labelled[bisect.bisect_left(not_labelled, page_id)]
+            bisect.insort(self.lists[LABELLED], page_id)
+            self.labelled.add(page_id)
+            return True
+
+    def refresh(self, labelled_dir):
+        """
+        同步其他进程写入的标注文件，标注目录的 mtime 没变化时不扫描
+        """
+        mtime = os.stat(labelled_dir).st_mtime_ns
+        if mtime == self.labelled_mtime:
+            return
+        self.labelled_mtime = mtime
+        for file in os.listdir(labelled_dir):
+            if not file.endswith(".json"):
+                continue
+            try:
+                page_id = int(file[: -len(".json")])
+            except ValueError:
+                continue
+            if page_id in self.members and page_id not in self.labelled:
+                self.mark_labelled(page_id)
+
+    def is_labelled(self, page_id):
+        return page_id in self.labelled
+
+    def count(self, filter=ALL):
+        with self.lock:
+            return len(self.lists.get(filter, self.page_ids))
+
+    def page(self, filter, start, limit):
+        """
+        按下标分页，返回 (page_ids, 总数, 每页的标注状态)
+        """
+        with self.lock:
+            page_ids = self.lists.get(filter, self.page_ids)
+            target_ids = page_ids[start : start + limit]
+            return target_ids, len(page_ids), self.flags(target_ids)
+
+    def after(self, filter, page_id, limit):
+        """
+        返回 page_id 之后的 limit 个页面，(page_ids, 总数, 标注状态, 起始下标)
+        page_id 为 None 时从头开始
+        """
+        with self.lock:
+            page_ids = self.lists.get(filter, self.page_ids)
+            start = 0 if page_id is None else bisect.bisect_right(page_ids, page_id)
+            target_ids = page_ids[start : start + limit]
+            return target_ids, len(page_ids), self.flags(target_ids), start
+
+    def next_page(self, page_id):
+        """
+        全部页面中 page_id 的下一页，没有时返回 None
+        """
+        with self.lock:
+            index = bisect.bisect_right(self.page_ids, page_id)
+            return self.page_ids[index] if index < len(self.page_ids) else None
+
+    def flags(self, page_ids):
+        return [1 if page_id in self.labelled else 0 for page_id in page_ids]
@@ -0,0 +1,469 @@
+"""
+推理路径一致性检查，用法：
+
+    python parity_check.py text --batch batch0
+    python parity_check.py image --batch batch0
+    python parity_check.py quantize --batch batch0
+    python parity_check.py engine --batch batch0
+    python parity_check.py cascade --batch batch0 --low 0.05 --high 0.95
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import a11y_mlp_classifier
+import node_geometry
+import numpy as np
+import online_focus_classifier
+import prelabel
+import torch
+from PIL import Image
+from torchvision import transforms
+from transformers import BertTokenizer
+
+static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def sample_nodes(batch, max_pages):
+    json_files = sorted(glob.glob(os.path.join(static_dir, batch, "*.json")))
+    for json_file in json_files[:max_pages]:
+        with open(json_file, "r", encoding="utf-8") as f:
+            yield from json.load(f)["nodes"]
+
+
+def sample_texts(batch, max_pages):
+    texts = {}
+    for node in sample_nodes(batch, max_pages):
+        texts.update(dict.fromkeys(a11y_mlp_classifier.node_texts(node)))
+    return list(texts)
+
+
+def check_text(args):
+    """
+    对比当前文本编码方式与原实现（慢速 tokenizer，补齐到 512）的 [CLS] embedding
+    """
+    config = a11y_mlp_classifier.config
+    model = a11y_mlp_classifier.get_model()
+    # 训练模式下 dropout 会让两种编码方式的结果随机不同
+    model.eval()
+
+    texts = sample_texts(args.batch, args.max_pages)
+    if not texts:
+        print(f"no pages in batch: {args.batch}")
+        return False
+
+    reference = model.embed_text(
+        texts,
+        padding="max_length",
+        tokenizer=BertTokenizer.from_pretrained(config.text_pretrained_name),
+        max_length=512,
+    )
+    current = model.embed_text(texts)
+    diffs = (reference - current).abs().max(dim=1).values.cpu()
+
+    mismatched = [(t, d.item()) for t, d in zip(texts, diffs) if d > args.atol]
+    print(
+        f"texts: {len(texts)}, padding: {config.text_padding}, "
+        f"fast tokenizer: {config.text_fast_tokenizer}, "
+        f"max_length: {config.text_max_length}"
+    )
+    print(f"max abs diff: {diffs.max().item():.3e}, mismatched: {len(mismatched)}")
+    for text, diff in mismatched[:10]:
+        print(f"  {diff:.3e} {text[:80]!r}")
+    return not mismatched
+
+
+def sample_pages(batch, max_pages):
+    dataset_dir = os.path.join(static_dir, batch)
+    json_files = sorted(glob.glob(os.path.join(dataset_dir, "*.json")))
+    for json_file in json_files[:max_pages]:
+        page_id = int(os.path.basename(json_file).split(".")[0])
+        image_file = os.path.join(
+            dataset_dir, f"{page_id}.png" if page_id >= 0 else f"{page_id}.jpg"
+        )
+        if not os.path.exists(image_file):
+            continue
+
+        image = Image.open(image_file).convert("RGB")
+        phone_width = 720 if page_id >= 0 else 1440
+        phone_height = 1600 if page_id >= 0 else 2560
+        x_ratio = image.size[0] / phone_width
+        y_ratio = image.size[1] / phone_height
+        with open(json_file, "r", encoding="utf-8") as f:
+            nodes = json.load(f)["nodes"]
+
+        coordinators = []
+        for node in nodes:
+            left, right, top, bottom = (
+                int(node["screen_left"] * x_ratio),
+                int(node["screen_right"] * x_ratio),
+                int(node["screen_top"] * y_ratio),
+                int(node["screen_bottom"] * y_ratio),
+            )
+            if 0 <= left < right and 0 <= top < bottom:
+                coordinators.append((left, right, top, bottom))
+        yield page_id, image, coordinators
+
+
+def check_image(args):
+    """
+    对比批量生成的截图输入与原来逐节点 transform 的结果
+    """
+    pages = mismatched = 0
+    max_diff = 0.0
+    for page_id, image, coordinators in sample_pages(args.batch, args.max_pages):
+        if not coordinators:
+            continue
+        coordinators = coordinators[: args.max_nodes]
+
+        reference = torch.stack(
+            [
+                transforms.Compose(
+                    [
+                        a11y_mlp_classifier.ScreenshotMaskTransform(coordinator),
+                        transforms.ToTensor(),
+                        transforms.Resize(256),
+                        a11y_mlp_classifier.RGBNormalizeTransform(
+                            [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+                        ),
+                    ]
+                )(image)
+                for coordinator in coordinators
+            ]
+        )
+        screenshot = a11y_mlp_classifier.screenshot_transform(image)
+        masks = a11y_mlp_classifier.create_masks(
+            image.size, coordinators, screenshot.shape[1:]
+        )
+        current = torch.cat(
+            (screenshot.expand(len(masks), -1, -1, -1), masks.unsqueeze(1)), dim=1
+        )
+
+        diff = (reference - current).abs().max().item()
+        max_diff = max(max_diff, diff)
+        pages += 1
+        if diff > args.atol:
+            mismatched += 1
+            print(f"  page {page_id}: max abs diff {diff:.3e}")
+
+    print(f"pages: {pages}, max abs diff: {max_diff:.3e}, mismatched: {mismatched}")
+    return pages > 0 and not mismatched
+
+
+def sample_v2_pages(batch, max_pages):
+    """
+    产出 (page_id, 截图, 有效节点的 PageNodes)
+    """
+    dataset_dir = os.path.join(static_dir, batch)
+    for page_id in prelabel.batch_page_ids(dataset_dir)[:max_pages]:
+        image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+        if not os.path.exists(image_file):
+            continue
+        page_image, nodes = prelabel.load_page(image_file, json_file)
+        page_nodes = node_geometry.valid_page_nodes(page_id, nodes)
+        if len(page_nodes):
+            yield page_id, page_image, page_nodes
+
+
+def sample_v2_batches(batch, max_pages):
+    """
+    产出 v2 模型输入，每页按 interval 分批
+    """
+    for page_id, page_image, page_nodes in sample_v2_pages(batch, max_pages):
+        page = a11y_mlp_classifier.prepare_page(page_image, page_id, page_nodes)
+        for i in range(0, len(page_nodes), a11y_mlp_classifier.interval):
+            yield a11y_mlp_classifier.make_batch(
+                [(page, i, i + a11y_mlp_classifier.interval)]
+            )
+
+
+def load_v2_model(quantize):
+    # build_model 不带文本 embedding 缓存，两个模型都完整计算一遍
+    config = a11y_mlp_classifier.config
+    cpu_quantize = config.cpu_quantize
+    config.cpu_quantize = quantize
+    try:
+        return a11y_mlp_classifier.build_model()
+    finally:
+        config.cpu_quantize = cpu_quantize
+
+
+def check_quantize(args):
+    """
+    对比 CPU 上 int8 动态量化模型与 fp32 模型的预测结果
+    """
+    config = a11y_mlp_classifier.config
+    if config.device.type != "cpu":
+        print(f"quantization only runs on cpu, current device: {config.device}")
+        return False
+
+    batches = list(sample_v2_batches(args.batch, args.max_pages))
+    if not batches:
+        print(f"no pages in batch: {args.batch}")
+        return False
+
+    outputs, seconds = {}, {}
+    for name, quantize in [("fp32", False), ("int8", True)]:
+        model = load_v2_model(quantize)
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs[name] = torch.cat([model(batch) for batch in batches])
+        seconds[name] = time.perf_counter() - start
+
+    nodes = len(outputs["fp32"])
+    agreement = (
+        (outputs["fp32"].argmax(dim=1) == outputs["int8"].argmax(dim=1))
+        .float()
+        .mean()
+        .item()
+    )
+    diffs = (outputs["fp32"][:, 1] - outputs["int8"][:, 1]).abs()
+    print(f"nodes: {nodes}, label agreement: {agreement:.4f}")
+    print(
+        f"prob abs diff: mean {diffs.mean().item():.3e}, "
+        f"max {diffs.max().item():.3e}"
+    )
+    print(
+        f"fp32: {seconds['fp32'] / nodes * 1000:.2f} ms/node, "
+        f"int8: {seconds['int8'] / nodes * 1000:.2f} ms/node"
+    )
+    return agreement >= args.min_agreement
+
+
+def pred_v2_nodes(page_image, page_id, page_nodes):
+    """
+    用完整模型预测 page_nodes 中的所有节点，返回每个节点的 (最大概率, 预测类别)
+    """
+    page = a11y_mlp_classifier.prepare_page(page_image, page_id, page_nodes)
+    results = []
+    for i in range(0, len(page_nodes), a11y_mlp_classifier.interval):
+        results.extend(
+            a11y_mlp_classifier.pred_segments(
+                [(page, i, i + a11y_mlp_classifier.interval)]
+            )
+        )
+    return results
+
+
+def check_cascade(args):
+    """
+    对比 cascade 与只用完整模型的预测结果，统计交给完整模型的节点比例和耗时
+    """
+    config = a11y_mlp_classifier.config
+    config.cascade = True
+    config.cascade_band = (args.low, args.high)
+    # 不带文本 embedding 缓存，两种方式的耗时可以比较
+    if config.backend == "torchscript":
+        a11y_mlp_classifier.model = a11y_mlp_classifier.ScriptedMLPModel(
+            config.engine_dir
+        )
+    else:
+        a11y_mlp_classifier.model = a11y_mlp_classifier.build_model()
+
+    pages = nodes = escalated = agreed = 0
+    positives = agreed_positives = 0
+    seconds = {"full": 0.0, "cascade": 0.0}
+    for page_id, page_image, page_nodes in sample_v2_pages(args.batch, args.max_pages):
+        start = time.perf_counter()
+        results, escalate = a11y_mlp_classifier.cascade_split(page_nodes, page_id)
+        if len(escalate):
+            escalated_results = pred_v2_nodes(
+                page_image, page_id, page_nodes.subset(escalate)
+            )
+            for i, result in zip(escalate, escalated_results):
+                results[i] = result
+        seconds["cascade"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        full = pred_v2_nodes(page_image, page_id, page_nodes)
+        seconds["full"] += time.perf_counter() - start
+
+        pages += 1
+        nodes += len(page_nodes)
+        escalated += len(escalate)
+        for (_, pred), (_, full_pred) in zip(results, full):
+            agreed += pred == full_pred
+            positives += full_pred == 1
+            agreed_positives += pred == full_pred == 1
+
+    if not nodes:
+        print(f"no pages in batch: {args.batch}")
+        return False
+
+    agreement = agreed / nodes
+    print(
+        f"pages: {pages}, nodes: {nodes}, band: ({args.low}, {args.high}), "
+        f"escalated: {escalated / nodes:.4f}"
+    )
+    print(
+        f"label agreement: {agreement:.4f}, "
+        f"full-model positives kept: {agreed_positives}/{positives}"
+    )
+    print(
+        f"full: {seconds['full'] / nodes * 1000:.2f} ms/node, "
+        f"cascade: {seconds['cascade'] / nodes * 1000:.2f} ms/node"
+    )
+    return agreement >= args.min_agreement
+
+
+def sample_v1_crops(batch, max_pages):
+    dataset_dir = os.path.join(static_dir, batch)
+    crops = []
+    for page_id in prelabel.batch_page_ids(dataset_dir)[:max_pages]:
+        image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+        if not os.path.exists(image_file):
+            continue
+        page_image, nodes = prelabel.load_page(image_file, json_file)
+        page_nodes = node_geometry.valid_page_nodes(page_id, nodes)
+        candidates = page_nodes.subset(page_nodes.interactive())
+        crops.append(
+            online_focus_classifier.prepare_crops(
+                page_image,
+                candidates.algo_coordinators(page_id, page_image.size).tolist(),
+            )
+        )
+    return np.concatenate(crops) if crops else None
+
+
+def timed(load):
+    start = time.perf_counter()
+    model = load()
+    return model, time.perf_counter() - start
+
+
+def compare_outputs(name, reference, current, labels, atol, seconds):
+    diff = (reference - current).abs().max().item()
+    agreement = sum(a == b for a, b in zip(labels(reference), labels(current))) / len(
+        reference
+    )
+    print(
+        f"{name}: samples {len(reference)}, max abs diff {diff:.3e}, "
+        f"label agreement {agreement:.4f}, "
+        f"load eager {seconds[0]:.2f}s / torchscript {seconds[1]:.2f}s"
+    )
+    return diff <= atol
+
+
+def check_engine_v1(args):
+    crops = sample_v1_crops(args.batch, args.max_pages)
+    if crops is None or not len(crops):
+        print(f"no pages in batch: {args.batch}")
+        return False
+
+    online_focus_classifier.backend = "eager"
+    eager, eager_seconds = timed(online_focus_classifier.load_model)
+    online_focus_classifier.backend = "torchscript"
+    scripted, scripted_seconds = timed(online_focus_classifier.load_model)
+
+    inputs = online_focus_classifier.crops_to_tensor(crops).to(
+        online_focus_classifier.device
+    )
+    outputs = []
+    with torch.no_grad():
+        for model in [eager, scripted]:
+            outputs.append(
+                torch.cat(
+                    [
+                        model(inputs[i : i + online_focus_classifier.batch_size])
+                        for i in range(
+                            0, len(inputs), online_focus_classifier.batch_size
+                        )
+                    ]
+                ).cpu()
+            )
+    return compare_outputs(
+        "v1",
+        *outputs,
+        lambda outputs: [online_focus_classifier.is_focus(o) for o in outputs],
+        args.atol,
+        (eager_seconds, scripted_seconds),
+    )
+
+
+def check_engine_v2(args):
+    config = a11y_mlp_classifier.config
+    batches = list(sample_v2_batches(args.batch, args.max_pages))
+    if not batches:
+        print(f"no pages in batch: {args.batch}")
+        return False
+
+    config.backend = "eager"
+    eager, eager_seconds = timed(a11y_mlp_classifier.build_model)
+    config.backend = "torchscript"
+    scripted, scripted_seconds = timed(
+        lambda: a11y_mlp_classifier.ScriptedMLPModel(config.engine_dir)
+    )
+
+    outputs = []
+    with torch.no_grad():
+        for model in [eager, scripted]:
+            outputs.append(torch.cat([model(batch) for batch in batches]).cpu())
+    return compare_outputs(
+        "v2",
+        *outputs,
+        lambda outputs: outputs.argmax(dim=1).tolist(),
+        args.atol,
+        (eager_seconds, scripted_seconds),
+    )
+
+
+def check_engine(args):
+    """
+    对比 export_engine.py 导出的 TorchScript 模型与 eager 模型的输出
+    """
+    checks = {"v1": check_engine_v1, "v2": check_engine_v2}
+    results = [checks[model](args) for model in args.models]
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    text_parser = subparsers.add_parser("text")
+    text_parser.add_argument("--batch", default="batch0")
+    text_parser.add_argument("--max-pages", type=int, default=20)
+    text_parser.add_argument("--atol", type=float, default=1e-4)
+    text_parser.set_defaults(func=check_text)
+
+    image_parser = subparsers.add_parser("image")
+    image_parser.add_argument("--batch", default="batch0")
+    image_parser.add_argument("--max-pages", type=int, default=5)
+    image_parser.add_argument("--max-nodes", type=int, default=64)
+    image_parser.add_argument("--atol", type=float, default=1e-6)
+    image_parser.set_defaults(func=check_image)
+
+    quantize_parser = subparsers.add_parser("quantize")
+    quantize_parser.add_argument("--batch", default="batch0")
+    quantize_parser.add_argument("--max-pages", type=int, default=5)
+    quantize_parser.add_argument("--min-agreement", type=float, default=0.99)
+    quantize_parser.set_defaults(func=check_quantize)
+
+    engine_parser = subparsers.add_parser("engine")
+    engine_parser.add_argument("--batch", default="batch0")
+    engine_parser.add_argument("--max-pages", type=int, default=5)
+    engine_parser.add_argument(
+        "--models", nargs="+", choices=["v1", "v2"], default=["v1", "v2"]
+    )
+    engine_parser.add_argument("--atol", type=float, default=1e-4)
+    engine_parser.set_defaults(func=check_engine)
+
+    config = a11y_mlp_classifier.config
+    cascade_parser = subparsers.add_parser("cascade")
+    cascade_parser.add_argument("--batch", default="batch0")
+    cascade_parser.add_argument("--max-pages", type=int, default=5)
+    cascade_parser.add_argument("--low", type=float, default=config.cascade_band[0])
+    cascade_parser.add_argument("--high", type=float, default=config.cascade_band[1])
+    cascade_parser.add_argument("--min-agreement", type=float, default=0.99)
+    cascade_parser.set_defaults(func=check_cascade)
+
+    args = parser.parse_args()
+    sys.exit(0 if args.func(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
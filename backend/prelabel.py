@@ -0,0 +1,54 @@
+import json
+import os
+
+import metrics
+from PIL import Image
+
+
+def screen_size(page_id):
+    """
+    正数 page_id 为 720x1600 的设备，负数为 1440x2560 的设备
+    返回 (phone_width, phone_height, extra_bottom)
+    """
+    if page_id >= 0:
+        return 720, 1600, 78
+    return 1440, 2560, 168
+
+
+def page_files(dataset_dir, page_id):
+    image_file = (
+        f"{dataset_dir}/{page_id}.png"
+        if page_id >= 0
+        else f"{dataset_dir}/{page_id}.jpg"
+    )
+    json_file = f"{dataset_dir}/{page_id}.json"
+    return image_file, json_file
+
+
+def decode_image(image_file):
+    with metrics.timer("image_decode"):
+        page_image = Image.open(image_file)
+        # png 4 通道，转成 rgb
+        if ".png" in image_file:
+            page_image = page_image.convert("RGB")
+        page_image.load()
+    return page_image
+
+
+def load_nodes(json_file):
+    with metrics.timer("json_parse"):
+        with open(json_file, "r", encoding="utf-8") as f:
+            return json.load(f)["nodes"]
+
+
+def load_page(image_file, json_file):
+    return decode_image(image_file), load_nodes(json_file)
+
+
+def batch_page_ids(dataset_dir):
+    page_ids = []
+    for file in os.listdir(dataset_dir):
+        if file.endswith(".json"):
+            page_ids.append(int(file.split(".")[0]))
+    page_ids.sort()
+    return page_ids
@@ -0,0 +1,246 @@
+"""
+离线批量预标注，结果写到 static/<batch>/prelabel/ 下，接口会优先返回这里的结果
+中断后重新执行会跳过已有结果（且页面和模型都没变）的页面，用法：
+
+    python prelabel_batch.py batch0 batch1 --models v1 v2 --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import a11y_mlp_classifier
+import node_sidecar
+import numpy as np
+import online_focus_classifier
+import prelabel
+import torch
+from inference_scheduler import NodeQueue
+from prelabel_cache import PrelabelCache
+
+static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def init_worker():
+    # 预处理进程各用一个线程，避免和推理进程抢 CPU
+    torch.set_num_threads(1)
+    # cascade 的小模型在预处理进程中加载，放在 CPU 上，
+    # 否则每个进程都会创建自己的 CUDA context；完整模型只在主进程中加载
+    a11y_mlp_classifier.config.device = torch.device("cpu")
+
+
+def prepare(dataset_dir, page_id, models):
+    """
+    在 worker 进程中解码截图、解析 json 并准备模型输入
+    """
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+    page_image = prelabel.decode_image(image_file)
+    page_nodes = node_sidecar.load_page_nodes(json_file)
+    page_nodes = page_nodes.subset(page_nodes.valid(page_id))
+
+    # model -> (node_ids, 模型输入, 已确定的结果, 需要模型计算的节点下标)
+    inputs = {}
+    if "v1" in models:
+        candidates = page_nodes.subset(page_nodes.interactive())
+        inputs["v1"] = (
+            candidates.ids.tolist(),
+            online_focus_classifier.prepare_crops(
+                page_image,
+                candidates.algo_coordinators(page_id, page_image.size).tolist(),
+            ),
+            None,
+            None,
+        )
+    if "v2" in models:
+        # 开启 cascade 时只为小模型不确定的节点准备完整模型的输入
+        results, escalate = a11y_mlp_classifier.cascade_split(page_nodes, page_id)
+        page = a11y_mlp_classifier.prepare_page(
+            page_image, page_id, page_nodes.subset(escalate)
+        )
+        inputs["v2"] = (page_nodes.ids.tolist(), page, results, escalate.tolist())
+    return inputs
+
+
+def pred_v1(segments):
+    crops = np.concatenate([crops[start:end] for crops, start, end in segments])
+    return online_focus_classifier.pred_crops(crops)
+
+
+class PageResult:
+    def __init__(self, model, key, node_ids, results=None, positions=None):
+        self.model = model
+        self.key = key
+        self.node_ids = node_ids
+        self.results = [None] * len(node_ids) if results is None else results
+        # 需要模型计算的节点在 results 中的下标，None 时为全部节点
+        self.positions = positions
+        self.remaining = sum(result is None for result in self.results)
+
+    def fill(self, start, results):
+        if self.positions is None:
+            self.results[start : start + len(results)] = results
+        else:
+            positions = self.positions[start : start + len(results)]
+            for position, result in zip(positions, results):
+                self.results[position] = result
+        self.remaining -= len(results)
+
+    def to_json(self):
+        if self.model == "v1":
+            return {
+                "labels": [
+                    node_id
+                    for node_id, pred in zip(self.node_ids, self.results)
+                    if pred
+                ]
+            }
+
+        labels, probs = a11y_mlp_classifier.page_labels(self.node_ids, self.results)
+        return {"labels": labels, "probs": probs}
+
+
+def pending_pages(batch, models):
+    """
+    返回 [(page_id, {model: key})]，只包含还没有有效结果的模型
+    """
+    dataset_dir = os.path.join(static_dir, batch)
+    store = PrelabelCache(dataset_dir, max_bytes=None, name="prelabel")
+    versions = {
+        "v1": online_focus_classifier.model_version,
+        "v2": a11y_mlp_classifier.model_version,
+    }
+    versions = {model: versions[model]() for model in models}
+
+    pages = []
+    for page_id in prelabel.batch_page_ids(dataset_dir):
+        image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+        if not os.path.exists(image_file):
+            continue
+
+        keys = {}
+        for model in models:
+            key = store.key(page_id, model, versions[model], [json_file, image_file])
+            if store.get(page_id, model, key) is None:
+                keys[model] = key
+        if keys:
+            pages.append((page_id, keys))
+    return store, pages
+
+
+def run_batch(batch, models, workers, batch_size):
+    dataset_dir = os.path.join(static_dir, batch)
+    store, pages = pending_pages(batch, models)
+    print(f"{batch}: {len(pages)} pages to pre-label")
+    if not pages:
+        return
+
+    v1_queue = NodeQueue(online_focus_classifier.batch_size, pred_v1)
+    # 截图缩放后尺寸不同的页面不能放在同一批
+    v2_queues = {}
+    page_results = {}
+    done = failed = 0
+    start_time = last_report = time.perf_counter()
+
+    def finish(page_id, model):
+        nonlocal done
+        result = page_results[page_id].pop(model)
+        store.put(page_id, model, result.key, result.to_json())
+        if not page_results[page_id]:
+            del page_results[page_id]
+            done += 1
+
+    def fill(model, queue, force=False):
+        for page_id, start, results in queue.flush(force):
+            result = page_results[page_id][model]
+            result.fill(start, results)
+            if result.remaining == 0:
+                finish(page_id, model)
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        workers, mp_context=context, initializer=init_worker
+    ) as executor:
+        todo = iter(pages)
+        futures = deque()
+
+        def submit():
+            # 只预取有限个页面，避免预处理结果堆积占满内存
+            while len(futures) < workers * 2:
+                page = next(todo, None)
+                if page is None:
+                    return
+                page_id, keys = page
+                futures.append(
+                    (page, executor.submit(prepare, dataset_dir, page_id, list(keys)))
+                )
+
+        submit()
+        while futures:
+            (page_id, keys), future = futures.popleft()
+            try:
+                inputs = future.result()
+            except Exception as e:
+                print(f"  page {page_id} failed: {e!r}")
+                failed += 1
+                submit()
+                continue
+            submit()
+
+            page_results[page_id] = {
+                model: PageResult(model, keys[model], node_ids, results, positions)
+                for model, (node_ids, _, results, positions) in inputs.items()
+            }
+            for model, (node_ids, data, _, positions) in inputs.items():
+                num = len(node_ids) if positions is None else len(positions)
+                if not num:
+                    finish(page_id, model)
+                elif model == "v1":
+                    v1_queue.add(page_id, data, num)
+                else:
+                    shape = tuple(data["screenshot"].shape)
+                    v2_queues.setdefault(
+                        shape, NodeQueue(batch_size, a11y_mlp_classifier.pred_segments)
+                    )
+                    v2_queues[shape].add(page_id, data, num)
+
+            fill("v1", v1_queue)
+            for queue in v2_queues.values():
+                fill("v2", queue)
+
+            now = time.perf_counter()
+            if now - last_report > 10:
+                last_report = now
+                print(
+                    f"  {done}/{len(pages)} pages, "
+                    f"{done / (now - start_time):.2f} pages/s"
+                )
+
+    fill("v1", v1_queue, force=True)
+    for queue in v2_queues.values():
+        fill("v2", queue, force=True)
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{batch}: {done} pages in {elapsed:.1f}s, "
+        f"{done / elapsed:.2f} pages/s, {failed} failed"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("batches", nargs="+")
+    parser.add_argument("--models", nargs="+", choices=["v1", "v2"], default=["v2"])
+    parser.add_argument("--workers", type=int, default=max(1, os.cpu_count() // 2))
+    # v2 每批的节点数，v1 使用 online_focus_classifier.batch_size
+    parser.add_argument("--batch-size", type=int, default=a11y_mlp_classifier.interval)
+    args = parser.parse_args()
+
+    for batch in args.batches:
+        run_batch(batch, args.models, args.workers, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def files_identity(files):
+    identity = []
+    for file in files:
+        stat = os.stat(file)
+        identity.append((os.path.basename(file), stat.st_size, stat.st_mtime_ns))
+    return identity
+
+
+class PrelabelCache:
+    """
+    预标注结果的磁盘缓存，放在 static/<batch>/<name>/ 下
+    每个 (page_id, endpoint) 一个文件，文件内记录 key：
+    模型版本或页面 json、截图有变化时 key 不同，视为未命中
+    总大小超过 max_bytes 时按最近访问时间淘汰，max_bytes 为 None 时不淘汰
+    """
+
+    def __init__(self, dataset_dir, max_bytes=64 * 1024 * 1024, name="prelabel_cache"):
+        self.cache_dir = os.path.join(dataset_dir, name)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = sum(
+            entry.stat().st_size for entry in os.scandir(self.cache_dir)
+        )
+
+    def key(self, page_id, endpoint, model_version, files):
+        identity = [page_id, endpoint, model_version, files_identity(files)]
+        return hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()
+
+    def cache_file(self, page_id, endpoint):
+        return os.path.join(self.cache_dir, f"{page_id}.{endpoint}.json")
+
+    def get(self, page_id, endpoint, key):
+        result = self.read(page_id, endpoint, key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def read(self, page_id, endpoint, key):
+        cache_file = self.cache_file(page_id, endpoint)
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+
+        # 更新 mtime 作为最近访问时间
+        os.utime(cache_file)
+        return entry["result"]
+
+    def put(self, page_id, endpoint, key, result):
+        cache_file = self.cache_file(page_id, endpoint)
+        data = json.dumps({"key": key, "result": result}).encode("utf-8")
+        tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+
+        with self.lock:
+            try:
+                self.total_bytes -= os.path.getsize(cache_file)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_file, cache_file)
+            self.total_bytes += len(data)
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        entries = sorted(
+            (entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".json")
+        )
+        self.total_bytes = sum(size for _, size, _ in entries)
+        # 淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    在后台线程中定时采样目标线程的调用栈，结果为 folded 格式，
+    可以直接用 flamegraph.pl 或 speedscope 查看
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                    f"{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, profile_dir, name):
+        """
+        写入 profile_dir/<时间>-<name>.folded，返回文件路径
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_file = os.path.join(
+            profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded"
+        )
+        with open(profile_file, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return profile_file
@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import prelabel
+
+
+def nbytes(value):
+    """
+    估算解码后截图（PIL Image）或模型输入（tensor）占用的内存
+    """
+    if hasattr(value, "element_size"):
+        return value.numel() * value.element_size()
+    return value.size[0] * value.size[1] * len(value.getbands())
+
+
+class ScreenshotCache:
+    """
+    进程内共享的截图解码缓存，以 (路径, mtime, 大小) 为 key，
+    除解码后的 RGB 图片外还可以缓存各模型需要的输入（variant）
+    总大小超过 max_bytes 时按最近使用顺序淘汰整张截图
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, prefetch_workers=1):
+        self.max_bytes = max_bytes
+        # key -> {variant 名: 值}，"image" 为解码后的图片
+        self.entries = OrderedDict()
+        self.entry_bytes = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            prefetch_workers, thread_name_prefix="screenshot-prefetch"
+        )
+        self.prefetching = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetches = 0
+
+    def key(self, image_file):
+        stat = os.stat(image_file)
+        return os.path.abspath(image_file), stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, key, name):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or name not in entry:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[name]
+
+    def store(self, key, name, value):
+        with self.lock:
+            entry = self.entries.setdefault(key, {})
+            self.entries.move_to_end(key)
+            if name in entry:
+                return entry[name]
+            entry[name] = value
+            size = nbytes(value)
+            self.entry_bytes[key] = self.entry_bytes.get(key, 0) + size
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted, _ = self.entries.popitem(last=False)
+                self.total_bytes -= self.entry_bytes.pop(evicted)
+                self.evictions += 1
+            return value
+
+    def get(self, image_file):
+        """
+        返回解码后的截图，png 转为 RGB
+        """
+        key = self.key(image_file)
+        image = self.lookup(key, "image")
+        if image is None:
+            image = self.store(key, "image", prelabel.decode_image(image_file))
+        return image
+
+    def get_variant(self, image_file, name, build):
+        """
+        返回 build(解码后的截图) 的缓存结果，如 v2 缩放归一化后的截图
+        结果会被多个请求共用，调用方不能原地修改
+        """
+        key = self.key(image_file)
+        value = self.lookup(key, name)
+        if value is None:
+            value = self.store(key, name, build(self.get(image_file)))
+        return value
+
+    def prefetch(self, image_file, variants=None):
+        """
+        在后台线程中提前解码截图，variants: {name: build}
+        """
+        with self.lock:
+            if image_file in self.prefetching:
+                return
+            self.prefetching.add(image_file)
+            self.prefetches += 1
+
+        def run():
+            try:
+                self.get(image_file)
+                for name, build in (variants or {}).items():
+                    self.get_variant(image_file, name, build)
+            except OSError:
+                pass
+            finally:
+                with self.lock:
+                    self.prefetching.discard(image_file)
+
+        self.executor.submit(run)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "prefetches": self.prefetches,
+            }
@@ -0,0 +1,171 @@
+"""
+生产环境的多进程服务，用法：
+
+    python serve.py --workers 4 --torch-threads 2 --port 15000
+
+主进程先加载模型，再 fork 出多个 worker 进程共用同一个监听端口，
+模型权重只加载一次，各 worker 通过写时复制共享；worker 异常退出时自动重启
+fork 出的子进程不能使用父进程初始化过的 CUDA，所以模型总是加载到 CPU 上
+每个 worker 内部仍是多线程处理请求，torch 的算子线程数限制为 --torch-threads，
+默认按 CPU 核数平分，避免多个 worker 抢占同一批核
+
+各 worker 的预标注缓存、截图缓存、攒批和 /metrics 统计相互独立；
+标注写入共用的日志 labelled/journal.log，用文件锁串行化各 worker 的写入，
+列表按标注目录同步其他 worker 的标注
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import app as server
+import label_journal
+import model_loader
+import torch
+from werkzeug.serving import make_server
+
+
+def recover_journals():
+    """
+    fork 之前合并上次运行留下的所有标注日志
+    """
+    for batch in os.listdir(server.static_dir):
+        labelled_dir = os.path.join(server.static_dir, batch, "labelled")
+        if batch not in server.exclude_dirs and os.path.isdir(labelled_dir):
+            label_journal.recover(labelled_dir)
+
+
+def use_cpu():
+    """
+    有 GPU 时默认 device 为 cuda:0，父进程在 CUDA 上加载模型后 fork，
+    worker 第一次推理就会失败，这里统一改用 CPU
+    """
+    import a11y_mlp_classifier
+    import online_focus_classifier
+
+    cpu = torch.device("cpu")
+    for name, device in [
+        ("v1", online_focus_classifier.device),
+        ("v2", a11y_mlp_classifier.config.device),
+    ]:
+        if device.type != "cpu":
+            print(f"{name}: {device} cannot be used after fork, using cpu", flush=True)
+    online_focus_classifier.device = cpu
+    a11y_mlp_classifier.config.device = cpu
+
+
+def preload(models):
+    for name in models:
+        start = time.perf_counter()
+        model_loader.get(name)
+        print(f"{name} loaded in {time.perf_counter() - start:.1f}s", flush=True)
+
+
+def run_worker(worker, sock, host, port, torch_threads):
+    torch.set_num_threads(torch_threads)
+    if model_loader.is_ready(["v2"]):
+        cache = model_loader.get("v2").get_model().text_embedding_cache
+        cache.after_fork()
+
+    http = make_server(host, port, server.app, threaded=True, fd=sock.fileno())
+    # SIGTERM 时退出 serve_forever，合并标注日志后再结束
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threading.Thread(target=server.load_all_page, daemon=True).start()
+    try:
+        http.serve_forever()
+    finally:
+        server.close_label_journals()
+
+
+def spawn(worker, sock, host, port, torch_threads):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(worker, sock, host, port, torch_threads)
+        except SystemExit as e:
+            code = e.code or 0
+        except BaseException:
+            import traceback
+
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(host, port, workers, torch_threads, models):
+    use_cpu()
+    recover_journals()
+    preload(models)
+    sock = socket.create_server((host, port), backlog=128)
+    sock.set_inheritable(True)
+    # 之后创建的对象不再被 gc 扫描，减少子进程中因 gc 导致的写时复制
+    gc.freeze()
+
+    children = {}
+    for worker in range(workers):
+        children[spawn(worker, sock, host, port, torch_threads)] = worker
+    print(
+        f"serving on {host}:{port} with {workers} workers, "
+        f"{torch_threads} torch threads each",
+        flush=True,
+    )
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker = children.pop(pid, None)
+        if worker is None or stopping:
+            continue
+        print(
+            f"worker {worker} (pid {pid}) exited with status {status}, restarting",
+            flush=True,
+        )
+        time.sleep(1)
+        children[spawn(worker, sock, host, port, torch_threads)] = worker
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=15000)
+    parser.add_argument("--workers", type=int, default=max(1, cpu_count // 4))
+    # 每个 worker 的 torch 算子线程数，默认 CPU 核数 / worker 数
+    parser.add_argument("--torch-threads", type=int)
+    # fork 之前加载的模型
+    parser.add_argument(
+        "--models", nargs="*", default=server.warm_up_models, choices=["v1", "v2"]
+    )
+    args = parser.parse_args()
+
+    torch_threads = args.torch_threads or max(1, cpu_count // args.workers)
+    serve(args.host, args.port, args.workers, torch_threads, args.models)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,15 @@
-import json
-import os
-import shutil
-
-labelled_page_ids = []
-for label_file in os.listdir("./labelled"):
-    if not ".json" in label_file or "-" in label_file or "file_map" in label_file:
-        continue
-
-    page_id = int(label_file.split(".")[0])
-    labelled_page_ids.append(page_id)
-
-labelled_page_ids.sort()
-
-start_index = 1000000
-file_map = {}
+"""
+导出本 batch 的标注数据，实际逻辑在 backend/export_dataset.py
+"""
 
-for page_id in labelled_page_ids:
-    with open(f"./{page_id}.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    with open(f"./labelled/{page_id}.json", "r", encoding="utf-8") as f:
-        labels = set(json.load(f))
-
-    for node in data["nodes"]:
-        if node["id"] in labels:
-            node["focusable_manual_label"] = True
-        else:
-            node["focusable_manual_label"] = False
-
-    with open(
-        f"../../../../../my_dataset/a11y/hierarchy/{start_index}.json",
-        "w",
-        encoding="utf-8",
-    ) as f:
-        json.dump(data, f)
+import os
+import sys
 
-    shutil.copyfile(
-        f"./{page_id}.png",
-        f"../../../../../my_dataset/a11y/screenshot/{start_index}.png",
-    )
+batch_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(batch_dir, "..", ".."))
 
-    file_map[page_id] = start_index
-    start_index += 1
+import export_dataset
 
-with open("./labelled/file_map.json", "w", encoding="utf-8") as f:
-    json.dump(file_map, f)
+if __name__ == "__main__":
+    sys.argv[1:1] = [os.path.basename(batch_dir)]
+    export_dataset.main()
@@ -0,0 +1,271 @@
+"""
+静态文件（截图、页面 json、标注 json）的发送：
+以内容 sha1 作为强 ETag，支持 If-None-Match / 304 和 Range；
+页面 json 有预先压缩的 .gz / .br 时按 Accept-Encoding 发送；
+截图可以请求缩小后的 webp / avif，如 /static/batch0/1.png?format=webp&width=720
+
+预压缩和生成截图缩略版本：
+
+    python static_delivery.py batch0 batch1 --formats webp avif --width 720 --workers 8
+
+压缩文件放在 json 旁边（<page_id>.json.gz），截图缩略版本放在
+<batch>/variants/<page_id>.w<width>.<format>，源文件更新后不会使用过期的版本
+"""
+
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import prelabel
+from flask import Response, send_file
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# 按优先顺序，Accept-Encoding 中都接受时使用靠前的
+encodings = {"br": ".br", "gzip": ".gz"}
+variant_formats = {"webp": "image/webp", "avif": "image/avif"}
+# Cache-Control 的 max-age，0 时浏览器每次都带 ETag 验证
+max_age = 0
+
+
+class EtagCache:
+    """
+    文件内容的 sha1，以 (路径, 大小, mtime) 为 key，文件不变时不重复计算
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, stat):
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            etag = self.entries.get(key)
+            if etag is not None:
+                self.entries.move_to_end(key)
+                return etag
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        etag = digest.hexdigest()
+        with self.lock:
+            self.entries[key] = etag
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return etag
+
+
+etags = EtagCache()
+
+
+def fresh_stat(path, source_stat):
+    """
+    path 存在且不比源文件旧时返回其 stat
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat if stat.st_mtime_ns >= source_stat.st_mtime_ns else None
+
+
+def variant_file(image_file, format, width):
+    dataset_dir, name = os.path.split(image_file)
+    page_id = name.split(".")[0]
+    return os.path.join(dataset_dir, "variants", f"{page_id}.w{width}.{format}")
+
+
+def send(path, mimetype=None, encoding=None, vary=None):
+    """
+    用 send_file 发送，由它处理 304 和 Range，ETag 为内容 sha1
+    """
+    stat = os.stat(path)
+    etag = etags.get(path, stat)
+    response = send_file(
+        path,
+        mimetype=mimetype or mimetypes.guess_type(path)[0],
+        conditional=True,
+        etag=etag,
+        max_age=max_age,
+    )
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    if vary is not None:
+        response.vary.add(vary)
+    return response
+
+
+def send_json(path, request):
+    """
+    有不过期的预压缩文件且客户端接受时发送压缩版本，不同编码的 ETag 不同
+    """
+    source_stat = os.stat(path)
+    for encoding, suffix in encodings.items():
+        # 返回 q 值，没有列出或 q=0 时为 0
+        if not request.accept_encodings[encoding]:
+            continue
+        compressed = path + suffix
+        if fresh_stat(compressed, source_stat) is not None:
+            return send(
+                compressed,
+                "application/json",
+                encoding=encoding,
+                vary="Accept-Encoding",
+            )
+    return send(path, "application/json", vary="Accept-Encoding")
+
+
+def send_image(path, request):
+    """
+    format、width 参数指定的缩略版本存在时发送缩略版本，否则发送原图
+    """
+    format = request.args.get("format")
+    # width 会拼进文件名，只接受正整数，其他值发送原图
+    try:
+        width = int(request.args.get("width", ""))
+    except ValueError:
+        width = 0
+    if format in variant_formats and width > 0:
+        variant = variant_file(path, format, width)
+        if fresh_stat(variant, os.stat(path)) is not None:
+            return send(variant, variant_formats[format])
+    return send(path)
+
+
+def send_content(data, request, mimetype="application/json"):
+    """
+    发送内存中生成的内容，如标注日志中尚未合并到文件的标注
+    """
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+def write_atomic(path, data):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+    os.replace(tmp_file, path)
+
+
+def precompress(json_file):
+    """
+    生成 .gz 和 .br（安装了 brotli 时），返回生成的文件数
+    """
+    source_stat = os.stat(json_file)
+    data = None
+    written = 0
+    for encoding, suffix in encodings.items():
+        if encoding == "br" and brotli is None:
+            continue
+        output = json_file + suffix
+        if fresh_stat(output, source_stat) is not None:
+            continue
+        if data is None:
+            with open(json_file, "rb") as f:
+                data = f.read()
+        if encoding == "br":
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        write_atomic(output, compressed)
+        written += 1
+    return written
+
+
+def make_variants(image_file, formats, width, quality):
+    """
+    生成缩小到 width 宽的各格式截图，原图不宽于 width 时只转换格式
+    """
+    source_stat = os.stat(image_file)
+    outputs = [(format, variant_file(image_file, format, width)) for format in formats]
+    outputs = [(f, o) for f, o in outputs if fresh_stat(o, source_stat) is None]
+    if not outputs:
+        return 0
+
+    image = prelabel.decode_image(image_file)
+    if image.size[0] > width:
+        height = round(image.size[1] * width / image.size[0])
+        image = image.resize((width, height), Image.LANCZOS)
+    for format, output in outputs:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        tmp_file = f"{output}.{os.getpid()}.tmp"
+        image.save(tmp_file, format=format.upper(), quality=quality)
+        os.replace(tmp_file, output)
+    return len(outputs)
+
+
+def convert_page(dataset_dir, page_id, formats, width, quality):
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+    compressed = precompress(json_file)
+    variants = make_variants(image_file, formats, width, quality) if formats else 0
+    return compressed, variants
+
+
+def convert_batch(executor, batch, formats, width, quality):
+    dataset_dir = os.path.join(static_dir, batch)
+    compressed = variants = failed = 0
+    start = time.perf_counter()
+    futures = [
+        (
+            page_id,
+            executor.submit(
+                convert_page, dataset_dir, page_id, formats, width, quality
+            ),
+        )
+        for page_id in prelabel.batch_page_ids(dataset_dir)
+    ]
+    for page_id, future in futures:
+        try:
+            page_compressed, page_variants = future.result()
+            compressed += page_compressed
+            variants += page_variants
+        except (OSError, ValueError, KeyError) as e:
+            # Pillow 不支持的格式保存时抛出 KeyError
+            print(f"  page {page_id} failed: {e!r}")
+            failed += 1
+    print(
+        f"{batch}: {compressed} compressed json, {variants} image variants, "
+        f"{failed} failed in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("batches", nargs="+")
+    # 截图缩略版本的格式，不指定时只压缩 json
+    parser.add_argument("--formats", nargs="*", default=[], choices=variant_formats)
+    parser.add_argument("--width", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("brotli is not installed, only gzip versions are generated")
+    # 如 AVIF 需要 pillow-avif-plugin 或较新的 Pillow，没有时 save 抛出 KeyError
+    Image.init()
+    formats = [format for format in args.formats if format.upper() in Image.SAVE]
+    for format in set(args.formats) - set(formats):
+        print(f"{format} is not supported by Pillow, skipped")
+    with ProcessPoolExecutor(args.workers) as executor:
+        for batch in args.batches:
+            convert_batch(executor, batch, formats, args.width, args.quality)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+from inference_scheduler import InferenceScheduler
+
+
+def test_failed_batch_does_not_shift_later_results():
+    calls = []
+
+    def pred(segments):
+        calls.append(segments)
+        if len(calls) == 1:
+            raise RuntimeError("batch failed")
+        return [data[i] for data, start, end in segments for i in range(start, end)]
+
+    scheduler = InferenceScheduler(pred, batch_size=4, max_wait=0.01)
+    first = [f"a{i}" for i in range(6)]
+    second = ["b0", "b1"]
+    # 持有锁时调度线程取不到节点，保证两个请求都在队列里：
+    # 第一批为 first[0:4]，first[4:6] 和 second 在之后的批中
+    with scheduler.condition:
+        first_request = scheduler.submit_async(first, len(first))
+        second_request = scheduler.submit_async(second, len(second))
+
+    with pytest.raises(RuntimeError):
+        scheduler.wait(first_request)
+    assert scheduler.wait(second_request) == second
+    # first 剩下的节点已从队列中去掉，不再计算
+    assert all(data is not first for segments in calls[1:] for data, _, _ in segments)
+    assert scheduler.stats()["queue_nodes"] == 0
+
+
+def test_results_follow_request_order():
+    scheduler = InferenceScheduler(
+        lambda segments: [
+            data[i] for data, start, end in segments for i in range(start, end)
+        ],
+        batch_size=3,
+        max_wait=0.01,
+    )
+    pages = [[f"{p}.{i}" for i in range(p + 1)] for p in range(5)]
+    results = [None] * len(pages)
+
+    def submit(p):
+        results[p] = scheduler.submit(pages[p], len(pages[p]))
+
+    threads = [threading.Thread(target=submit, args=(p,)) for p in range(len(pages))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == pages
@@ -0,0 +1,119 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+# 已缓存的 embedding 不再可用时加一，旧的记录不会再被命中
+# 2: 之前的记录可能是在模型的训练模式下（dropout 打开）计算的
+cache_format = 2
+
+
+class TextEmbeddingCache:
+    """
+    文本 embedding 缓存，按 (模型版本, 字符串) 寻址
+    内存中为有上限的 LRU，可选落盘到 sqlite，重启后仍可复用
+    """
+
+    def __init__(self, version, max_size=100000, cache_file=None):
+        self.version = version
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+        self.db = None
+        self.connect()
+
+    def connect(self):
+        if self.cache_file:
+            self.db = sqlite3.connect(self.cache_file, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, value BLOB)"
+            )
+            self.db.commit()
+
+    def after_fork(self):
+        """
+        fork 出的子进程不能继续使用父进程的 sqlite 连接，重新连接
+        """
+        self.lock = threading.Lock()
+        self.connect()
+
+    def key(self, text):
+        return hashlib.sha1(
+            f"{cache_format}\0{self.version}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def get_many(self, texts):
+        """
+        返回 {text: embedding}，只包含命中的字符串
+        """
+        texts = set(texts)
+        found, disk_keys = {}, {}
+        with self.lock:
+            for text in texts:
+                key = self.key(text)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[text] = self.entries[key]
+                else:
+                    disk_keys[key] = text
+
+            if self.db is not None and disk_keys:
+                keys = list(disk_keys)
+                # sqlite 单条语句的参数个数有上限，分批查询
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i : i + 500]
+                    rows = self.db.execute(
+                        "SELECT key, value FROM embedding WHERE key IN (%s)"
+                        % ",".join("?" * len(chunk)),
+                        chunk,
+                    ).fetchall()
+                    for key, value in rows:
+                        embedding = torch.from_numpy(
+                            np.frombuffer(value, dtype=np.float32).copy()
+                        )
+                        found[disk_keys[key]] = embedding
+                        self._put(key, embedding)
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, texts, embeddings):
+        """
+        embeddings: [N, H]，与 texts 一一对应
+        """
+        embeddings = embeddings.detach().to("cpu", torch.float32)
+        rows = []
+        with self.lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                embedding = embedding.clone()
+                self._put(key, embedding)
+                rows.append((key, embedding.numpy().tobytes()))
+
+            if self.db is not None and rows:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO embedding (key, value) VALUES (?, ?)", rows
+                )
+                self.db.commit()
+
+    def _put(self, key, embedding):
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,139 @@
+"""
+训练 cascade 用的属性小模型（见 a11y_mlp_classifier.config.cascade），用法：
+
+    python export_dataset.py batch0 batch1 --shards
+    python train_attribute_model.py ../../../my_dataset/a11y/shards --epochs 5
+
+只使用训练分片中的 attributes 和 labels 列，每 holdout 页留一页做验证，
+输出验证集上的准确率、cascade_band 内（需要交给完整模型）的节点比例，
+以及小模型自己决定的节点上的准确率；模型保存到 config.cascade_checkpoint_file
+对比 cascade 与只用完整模型的结果见 parity_check.py cascade
+"""
+
+import argparse
+import os
+import time
+
+import a11y_mlp_classifier
+import torch
+import torch.nn.functional as F
+import training_shards
+from export_dataset import default_output
+
+
+def evaluate(model, batches, band):
+    """
+    batches: [(attributes, labels)]
+    """
+    config = a11y_mlp_classifier.config
+    probs, labels = [], []
+    with torch.no_grad():
+        for attributes, target in batches:
+            if len(target):
+                outputs = model(attributes.to(config.device))
+                probs.append(torch.softmax(outputs, dim=1)[:, 1].cpu())
+                labels.append(target)
+    if not probs:
+        return None
+
+    probs, labels = torch.cat(probs), torch.cat(labels)
+    preds = (probs >= 0.5).long()
+    low, high = band
+    decided = (probs <= low) | (probs >= high)
+    return {
+        "nodes": len(labels),
+        "accuracy": (preds == labels).float().mean().item(),
+        "escalated_ratio": 1 - decided.float().mean().item(),
+        "decided_accuracy": (
+            (preds[decided] == labels[decided]).float().mean().item()
+            if decided.any()
+            else None
+        ),
+    }
+
+
+def train(args):
+    config = a11y_mlp_classifier.config
+    torch.manual_seed(args.seed)
+    dataset = training_shards.ShardDataset(
+        args.shards, batch_size=args.batch_size, seed=args.seed
+    )
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=None, num_workers=args.workers
+    )
+    model = a11y_mlp_classifier.build_attribute_model()
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    band = (args.low, args.high)
+
+    for epoch in range(args.epochs):
+        start = time.perf_counter()
+        dataset.set_epoch(epoch)
+        model.train()
+        validation = []
+        total_loss = nodes = 0
+        for batch in loader:
+            held = (
+                batch["page_index"] % args.holdout == 0
+                if args.holdout
+                else torch.zeros(len(batch["labels"]), dtype=torch.bool)
+            )
+            labels = batch["labels"].long()
+            validation.append((batch["attributes"][held], labels[held]))
+
+            attributes, labels = batch["attributes"][~held], labels[~held]
+            if not len(labels):
+                continue
+            loss = F.cross_entropy(
+                model(attributes.to(config.device)), labels.to(config.device)
+            )
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(labels)
+            nodes += len(labels)
+
+        model.eval()
+        stats = evaluate(model, validation, band)
+        message = (
+            f"epoch {epoch + 1}: {nodes} nodes, "
+            f"loss {total_loss / max(nodes, 1):.4f}"
+        )
+        if stats is not None:
+            decided_accuracy = stats["decided_accuracy"]
+            message += (
+                f", validation {stats['nodes']} nodes, "
+                f"accuracy {stats['accuracy']:.4f}, "
+                f"escalated {stats['escalated_ratio']:.4f}, decided accuracy "
+                + ("-" if decided_accuracy is None else f"{decided_accuracy:.4f}")
+            )
+        print(f"{message} in {time.perf_counter() - start:.1f}s")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    tmp_file = f"{args.output}.{os.getpid()}.tmp"
+    torch.save(model.state_dict(), tmp_file)
+    os.replace(tmp_file, args.output)
+    print(f"saved to {args.output}")
+
+
+def main():
+    config = a11y_mlp_classifier.config
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "shards", nargs="?", default=os.path.join(default_output, "shards")
+    )
+    parser.add_argument("--output", default=config.cascade_checkpoint_file)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    # 每 holdout 页留一页做验证，0 时不验证
+    parser.add_argument("--holdout", type=int, default=10)
+    # 验证时统计的 cascade_band
+    parser.add_argument("--low", type=float, default=config.cascade_band[0])
+    parser.add_argument("--high", type=float, default=config.cascade_band[1])
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    train(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
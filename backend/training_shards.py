@@ -0,0 +1,294 @@
+"""
+训练用的分片数据：每个分片是一个目录，各列为一个 .npy 文件，读取时直接 mmap
+
+    <root>/manifest.json       分片列表、batch 名、列说明
+    <root>/texts.json          去重后的文本表，text_ids 为其中的下标
+    <root>/text_embeddings.npy 可选，texts 对应的 [CLS] embedding，float16 [V, 768]
+    <root>/shard-00000/
+        attributes.npy   float32 [N, 15]，与 a11y_mlp_classifier 的属性向量一致
+        coordinators.npy int32 [N, 4]，截图上的像素坐标 (left, right, top, bottom)
+        text_ids.npy     int32 [N, 4]，模型使用的四个文本字段
+        labels.npy       uint8 [N]，focusable_manual_label
+        node_ids.npy     int64 [N]
+        node_pages.npy   int32 [N]，节点所在页在 pages 中的行号
+        pages.npy        int64 [P, 7]，(batch, page_id, index, start, end, width, height)
+
+只包含坐标有效的节点，与 pred_model 一致；一页的节点不会跨分片
+由 export_dataset.py --shards 生成，训练时用 ShardDataset 读取
+"""
+
+import json
+import os
+import shutil
+
+import a11y_mlp_classifier
+import node_geometry
+import node_sidecar
+import numpy as np
+import prelabel
+import torch
+from PIL import Image
+
+version = 1
+page_columns = ["batch", "page_id", "index", "start", "end", "width", "height"]
+
+
+def page_features(dataset_dir, page_id):
+    """
+    在 worker 进程中计算一页的特征，texts 为本页去重后的文本，text_ids 为其中的下标
+    """
+    image_file, json_file = prelabel.page_files(dataset_dir, page_id)
+    page_nodes = node_sidecar.load_page_nodes(json_file)
+    page_nodes = page_nodes.subset(page_nodes.valid(page_id))
+    with open(
+        os.path.join(dataset_dir, "labelled", f"{page_id}.json"), "r", encoding="utf-8"
+    ) as f:
+        labels = set(json.load(f))
+    # 只读取文件头
+    with Image.open(image_file) as image:
+        image_size = image.size
+
+    texts, text_index = [], {}
+    text_ids = np.empty((len(page_nodes), 4), dtype=np.int32)
+    for i, fields in enumerate(
+        zip(*(page_nodes.texts[f] for f in node_geometry.text_fields))
+    ):
+        for j, text in enumerate(a11y_mlp_classifier.text_fields(*fields)):
+            if text not in text_index:
+                text_index[text] = len(texts)
+                texts.append(text)
+            text_ids[i, j] = text_index[text]
+
+    node_ids = page_nodes.ids.tolist()
+    return {
+        "image_size": image_size,
+        "attributes": page_nodes.attributes(page_id),
+        "coordinators": page_nodes.algo_coordinators(page_id, image_size).astype(
+            np.int32
+        ),
+        "texts": texts,
+        "text_ids": text_ids,
+        "labels": np.array([node_id in labels for node_id in node_ids], dtype=np.uint8),
+        "node_ids": np.array(node_ids, dtype=np.int64),
+    }
+
+
+class ShardWriter:
+    """
+    按页追加特征，节点数达到 shard_nodes 后写出一个分片
+    先写到 <root>.tmp，close() 时整体替换 root
+    """
+
+    def __init__(self, root, batches, shard_nodes=1 << 20):
+        self.root = root
+        self.tmp_root = f"{root}.tmp"
+        self.batches = batches
+        self.shard_nodes = shard_nodes
+        shutil.rmtree(self.tmp_root, ignore_errors=True)
+        os.makedirs(self.tmp_root)
+
+        self.texts, self.text_index = [], {}
+        self.shards = []
+        self.total_nodes = self.total_pages = 0
+        self.reset()
+
+    def reset(self):
+        self.pages = []
+        self.columns = {
+            "attributes": [],
+            "coordinators": [],
+            "text_ids": [],
+            "labels": [],
+            "node_ids": [],
+            "node_pages": [],
+        }
+        self.count = 0
+
+    def add(self, batch, page_id, index, features):
+        # 本页的文本下标换成全局下标
+        mapping = np.empty(len(features["texts"]), dtype=np.int32)
+        for i, text in enumerate(features["texts"]):
+            text_id = self.text_index.get(text)
+            if text_id is None:
+                text_id = self.text_index[text] = len(self.texts)
+                self.texts.append(text)
+            mapping[i] = text_id
+
+        num = len(features["node_ids"])
+        width, height = features["image_size"]
+        self.pages.append(
+            [batch, page_id, index, self.count, self.count + num, width, height]
+        )
+        for name in ["attributes", "coordinators", "labels", "node_ids"]:
+            self.columns[name].append(features[name])
+        self.columns["text_ids"].append(mapping[features["text_ids"]])
+        self.columns["node_pages"].append(
+            np.full(num, len(self.pages) - 1, dtype=np.int32)
+        )
+        self.count += num
+        if self.count >= self.shard_nodes:
+            self.flush()
+
+    def flush(self):
+        if not self.pages:
+            return
+        name = f"shard-{len(self.shards):05d}"
+        shard_dir = os.path.join(self.tmp_root, name)
+        os.makedirs(shard_dir)
+        for column, values in self.columns.items():
+            np.save(os.path.join(shard_dir, f"{column}.npy"), np.concatenate(values))
+        np.save(
+            os.path.join(shard_dir, "pages.npy"), np.array(self.pages, dtype=np.int64)
+        )
+        self.shards.append(
+            {"name": name, "nodes": self.count, "pages": len(self.pages)}
+        )
+        self.total_nodes += self.count
+        self.total_pages += len(self.pages)
+        self.reset()
+
+    def write_text_embeddings(self, batch_size=4096):
+        """
+        用当前的 v2 模型计算文本表的 embedding，训练时冻结 BERT 可直接使用
+        """
+        model = a11y_mlp_classifier.get_model()
+        embeddings = None
+        for i in range(0, len(self.texts), batch_size):
+            embedding = model.embed_text(self.texts[i : i + batch_size])
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    os.path.join(self.tmp_root, "text_embeddings.npy"),
+                    mode="w+",
+                    dtype=np.float16,
+                    shape=(len(self.texts), embedding.shape[1]),
+                )
+            embeddings[i : i + len(embedding)] = embedding.float().cpu().numpy()
+        if embeddings is not None:
+            embeddings.flush()
+        return a11y_mlp_classifier.model_version()
+
+    def close(self, sources, text_embeddings=False):
+        self.flush()
+        with open(
+            os.path.join(self.tmp_root, "texts.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(self.texts, f)
+        manifest = {
+            "version": version,
+            "batches": self.batches,
+            "page_columns": page_columns,
+            "shards": self.shards,
+            "nodes": self.total_nodes,
+            "pages": self.total_pages,
+            "texts": len(self.texts),
+            "text_embeddings": (
+                self.write_text_embeddings() if text_embeddings else None
+            ),
+            # 源文件的 (大小, mtime)，没变化时不重新生成
+            "sources": sources,
+        }
+        with open(
+            os.path.join(self.tmp_root, "manifest.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(manifest, f)
+
+        old_root = f"{self.root}.old"
+        shutil.rmtree(old_root, ignore_errors=True)
+        if os.path.exists(self.root):
+            os.replace(self.root, old_root)
+        os.replace(self.tmp_root, self.root)
+        shutil.rmtree(old_root, ignore_errors=True)
+        return manifest
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(root, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if manifest.get("version") == version else None
+
+
+def load_shard(root, name):
+    shard_dir = os.path.join(root, name)
+    return {
+        file.split(".")[0]: np.load(os.path.join(shard_dir, file), mmap_mode="r")
+        for file in os.listdir(shard_dir)
+        if file.endswith(".npy")
+    }
+
+
+def load_texts(root):
+    with open(os.path.join(root, "texts.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_text_embeddings(root):
+    return np.load(os.path.join(root, "text_embeddings.npy"), mmap_mode="r")
+
+
+class ShardDataset(torch.utils.data.IterableDataset):
+    """
+    按 batch 读取节点，每个 batch 为 {列名: tensor}，额外包含
+    page_index（截图为 screenshot/<page_index>.png）、width、height
+    shuffle 时打乱分片顺序和分片内节点顺序；多个 DataLoader worker 时按分片划分
+    配合 DataLoader(dataset, batch_size=None) 使用，每个 epoch 开始前调用 set_epoch
+    """
+
+    def __init__(self, root, batch_size=1024, shuffle=True, seed=0, drop_last=False):
+        self.root = root
+        self.manifest = read_manifest(root)
+        if self.manifest is None:
+            raise FileNotFoundError(f"no training shards in {root}")
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(s["nodes"] // self.batch_size for s in self.manifest["shards"])
+        return sum(-(-s["nodes"] // self.batch_size) for s in self.manifest["shards"])
+
+    def set_epoch(self, epoch):
+        """
+        打乱顺序由 (seed, epoch) 决定，DataLoader worker 中的副本每个 epoch
+        重新创建，所以 epoch 要在主进程中设置，而不是在 __iter__ 中自增
+        """
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+
+        shards = [s["name"] for s in self.manifest["shards"]]
+        if self.shuffle:
+            shards = [shards[i] for i in rng.permutation(len(shards))]
+        worker = torch.utils.data.get_worker_info()
+        if worker is not None:
+            shards = shards[worker.id :: worker.num_workers]
+
+        for name in shards:
+            shard = load_shard(self.root, name)
+            pages = np.asarray(shard.pop("pages"))
+            count = len(shard["labels"])
+            order = rng.permutation(count) if self.shuffle else None
+            for start in range(0, count, self.batch_size):
+                end = min(start + self.batch_size, count)
+                if self.drop_last and end - start < self.batch_size:
+                    break
+                if order is None:
+                    index = slice(start, end)
+                else:
+                    # 排序后访问 mmap 更接近顺序读
+                    index = np.sort(order[start:end])
+                batch = {
+                    column: torch.from_numpy(np.ascontiguousarray(values[index]))
+                    for column, values in shard.items()
+                }
+                node_pages = pages[batch["node_pages"].numpy()]
+                batch["page_index"] = torch.from_numpy(node_pages[:, 2])
+                batch["width"] = torch.from_numpy(node_pages[:, 5])
+                batch["height"] = torch.from_numpy(node_pages[:, 6])
+                yield batch
@@ -173,6 +173,26 @@ const canvas = document.getElementById("page-canvas");
 const ctx = canvas.getContext("2d");
 const phone_height = page_id >= 0 ? 1600 : 2560, phone_width = page_id >= 0 ? 720 : 1440, extra_bottom = page_id >= 0 ? 78 : 168;
 
+// 节点、标注、已缓存的预标注一次取回，与截图并行请求
+const page_fields = [
+    "id",
+    "father",
+    "class_name",
+    "text",
+    "content_description",
+    "clickable",
+    "focusable",
+    "long_clickable",
+    "package_name",
+    "focusable_shouldFocusNode",
+    "focusable_isAccessibilityFocusable",
+    "is_web_node",
+    "bounds",
+];
+const page_bundle = fetch(
+    `${backend_url}/get/page?batch=${batch}&page_id=${page_id}&nodes=all&fields=${page_fields.join(",")}`
+).then((response) => response.json());
+
 image.src = page_id >= 0 ? `${backend_url}/static/${batch}/${page_id}.png` : `${backend_url}/static/${batch}/${page_id}.jpg`;
 image.onload = function () {
     canvas.width = image.width;
@@ -191,14 +211,8 @@ function isEmpty(obj) {
 }
 
 function json2node(node) {
-    let [left, right, top, bottom] = [
-        node.screen_left,
-        node.screen_right,
-        node.screen_top,
-        node.screen_bottom,
-    ];
-    bottom = Math.min(bottom, phone_height - extra_bottom);
-    right = Math.min(right, phone_width)
+    // /get/page 返回的 bounds 已截掉导航栏和屏幕外的部分
+    let [left, right, top, bottom] = node.bounds;
     let valid =
         left >= 0 &&
         right >= 0 &&
@@ -252,69 +266,54 @@ function json2tree(nodes) {
     return [root];
 }
 
+function bundleNodes(bundle) {
+    return bundle.nodes.map((row) =>
+        Object.fromEntries(bundle.fields.map((field, i) => [field, row[i]]))
+    );
+}
+
 function reloadCode(page_id) {
     let imageHeight = document.getElementById("page-image").clientHeight;
     vm.viewTreeHeight = imageHeight;
 
-    const origin_json_url = `${backend_url}/static/${batch}/${page_id}.json`;
-    fetch(origin_json_url)
-        .then((response) => response.json())
-        .then((origin_data) => {
-            const labelled_json_url = `${backend_url}/static/${batch}/labelled/${page_id}.json`;
-            fetch(labelled_json_url)
-                .then((response) => {
-                    if (response.status === 404) {
-                        return [];
-                    }
-                    return response.json();
-                })
-                .then((labelled_data) => {
-                    let labelled_page_ids = new Set(labelled_data);
-                    let nodes = origin_data["nodes"];
-                    for (let node of nodes) {
-                        if (!labelled_page_ids.has(node.id)) {
-                            continue;
-                        }
-                        node.focusable_label = true;
-
-                        let [left, right, top, bottom] = [
-                            node.screen_left,
-                            node.screen_right,
-                            node.screen_top,
-                            node.screen_bottom,
-                        ];
-                        bottom = Math.min(bottom, phone_height - extra_bottom);
-                        let coordinator = {
-                            x: left * canvas.xratio,
-                            y: top * canvas.yratio,
-                            width: (right - left) * canvas.xratio,
-                            height: (bottom - top) * canvas.yratio,
-                        };
-                        let key = JSON.stringify(coordinator);
-                        vm.labelledPageIds.set(node.id, coordinator);
-                        if (vm.labelledCoordinators.has(key)) {
-                            vm.labelledCoordinators.set(
-                                key,
-                                vm.labelledCoordinators.get(key) + 1
-                            );
-                        } else {
-                            vm.labelledCoordinators.set(key, 1);
-                        }
-                    }
-                    return nodes;
-                })
-                .then((nodes) => {
-                    vm.treeData = json2tree(nodes);
-                })
-                .then(() => {
-                    vm.$refs.treeRef.filter(vm.checkedTypes);
-                })
-                .then(() => {
-                    drawAllLabel();
-                })
-                .catch((error) => {
-                    console.log(error);
-                });
+    page_bundle
+        .then((bundle) => {
+            let labelled_page_ids = new Set(bundle.labels);
+            let nodes = bundleNodes(bundle);
+            for (let node of nodes) {
+                if (!labelled_page_ids.has(node.id)) {
+                    continue;
+                }
+                node.focusable_label = true;
+
+                let [left, right, top, bottom] = node.bounds;
+                let coordinator = {
+                    x: left * canvas.xratio,
+                    y: top * canvas.yratio,
+                    width: (right - left) * canvas.xratio,
+                    height: (bottom - top) * canvas.yratio,
+                };
+                let key = JSON.stringify(coordinator);
+                vm.labelledPageIds.set(node.id, coordinator);
+                if (vm.labelledCoordinators.has(key)) {
+                    vm.labelledCoordinators.set(
+                        key,
+                        vm.labelledCoordinators.get(key) + 1
+                    );
+                } else {
+                    vm.labelledCoordinators.set(key, 1);
+                }
+            }
+            return nodes;
+        })
+        .then((nodes) => {
+            vm.treeData = json2tree(nodes);
+        })
+        .then(() => {
+            vm.$refs.treeRef.filter(vm.checkedTypes);
+        })
+        .then(() => {
+            drawAllLabel();
         })
         .catch((error) => console.error("Error:", error));
 }
@@ -577,7 +576,8 @@ function dfsPreLabelNode(node, preLabelSet=null, preLabelProb=null) {
     if (node.valid) {
         if (preLabelSet != null) {
             node.focusable_label = preLabelSet.has(node.id)
-            if (preLabelProb != null) {
+            // 流式预标注中还没算到的节点没有概率
+            if (preLabelProb != null && node.id in preLabelProb) {
                 let p = preLabelProb[node.id];
                 let high_p = p > max_p;
                 let prefix = '<b style="color: red; font-size: 20px;">';
@@ -644,6 +644,49 @@ function drawBoxes() {
     ctx.stroke();
 }
 
+// 流式预标注：/get/page 中已缓存的结果直接使用，否则读取 NDJSON，
+// 每收到一段就以累计的 labels / probs 调用 onChunk，最后一次为完整结果
+function streamPreLabels(url, endpoint, onChunk) {
+    return page_bundle.then((bundle) => {
+        if (bundle.prelabels && bundle.prelabels[endpoint]) {
+            onChunk(bundle.prelabels[endpoint]);
+            return;
+        }
+        return fetch(url, {
+            method: "GET",
+            mode: "cors",
+        }).then(async (response) => {
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let buffer = "", labels = [], probs = {};
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    throw new Error("prelabel stream ended early");
+                }
+                buffer += value;
+                let lines = buffer.split("\n");
+                buffer = lines.pop();
+                for (let line of lines) {
+                    if (!line) {
+                        continue;
+                    }
+                    let event = JSON.parse(line);
+                    if (event.event === "error") {
+                        throw new Error(event.msg);
+                    }
+                    if (event.event === "done") {
+                        onChunk(event);
+                        return;
+                    }
+                    labels.push(...event.labels);
+                    Object.assign(probs, event.probs);
+                    onChunk({ labels: labels, probs: event.probs ? probs : undefined });
+                }
+            }
+        });
+    });
+}
+
 function preLabelByAlgoBase(url) {
     let layer = layui.layer;
     layer.confirm(
@@ -655,18 +698,12 @@ function preLabelByAlgoBase(url) {
         },
         function () {
             let load_index = layer.load(0, {shade: false});
-            fetch(url, {
-                method: "GET",
-                mode: "cors",
-            })
-            .then((data) => data.json())
-            .then((data) => {
-                return data.labels;
-            })
-            .then((labels) => {
+            streamPreLabels(url, "v1", (data) => {
                 doReset();
-                dfsPreLabelNode(vm.treeData[0], new Set(labels));
+                dfsPreLabelNode(vm.treeData[0], new Set(data.labels));
                 drawBoxes();
+            })
+            .then(() => {
                 layer.close(load_index); 
                 layer.msg("预标完成", { icon: 1 });
             })
@@ -681,11 +718,11 @@ function preLabelByAlgoBase(url) {
 }
 
 function preLabelByAlgo() {
-    preLabelByAlgoBase(`${backend_url}/get/prelabel/algo?page_id=${page_id}&batch=${batch}`);
+    preLabelByAlgoBase(`${backend_url}/get/prelabel/algo/stream?page_id=${page_id}&batch=${batch}`);
 }
 
 function preLabelByAlgoV2() {
-    const url = `${backend_url}/get/prelabel/algo/v2?page_id=${page_id}&batch=${batch}`;
+    const url = `${backend_url}/get/prelabel/algo/v2/stream?page_id=${page_id}&batch=${batch}`;
     let layer = layui.layer;
     layer.confirm(
         "预标前会将当前所有标注清空，是否确定？",
@@ -696,15 +733,12 @@ function preLabelByAlgoV2() {
         },
         function () {
             let load_index = layer.load(0, {shade: false});
-            fetch(url, {
-                method: "GET",
-                mode: "cors",
-            })
-            .then((data) => data.json())
-            .then((data) => {
+            streamPreLabels(url, "v2", (data) => {
                 doReset();
                 dfsPreLabelNode(vm.treeData[0], new Set(data.labels), data.probs);
                 drawBoxes();
+            })
+            .then(() => {
                 layer.close(load_index); 
                 layer.msg("预标完成", { icon: 1 });
             })